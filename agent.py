@@ -1,12 +1,20 @@
 import os 
 import yaml
-import json
-import requests
 from datetime import datetime, timezone
 from termcolor import colored
-from prompts import planning_agent_prompt, integration_agent_prompt, check_response_prompt, check_response_json
+from prompts import planning_agent_prompt as default_planning_agent_prompt, integration_agent_prompt as default_integration_agent_prompt, check_response_prompt as default_check_response_prompt
+from prompts import check_response_json, planning_agent_sections, integration_agent_sections, integration_agent_footer, check_response_sections
+from prompt_layout import PromptLayout
 from search import WebSearcher
-import ast
+from http_client import HTTPClient
+from llm_backends import get_backend, parse_json, RequestBatcher
+from cache import SearchCache, PageCache, AnswerCache, CompletionMemo
+from memory import MemoryStore, FeedbackContext
+import asyncio
+import tracing
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
 
 
 def load_config(file_path):
@@ -15,68 +23,23 @@ def load_config(file_path):
         for key, value in config.items():
             os.environ[key] = value
 
-def get_current_utc_datetime():
+def get_current_utc_datetime(date_only=False):
     now_utc = datetime.now(timezone.utc)
-    current_time_utc = now_utc.strftime("%Y-%m-%d %H:%M:%S %Z")
+    current_time_utc = now_utc.strftime("%Y-%m-%d %Z" if date_only else "%Y-%m-%d %H:%M:%S %Z")
     return current_time_utc
 
-def save_feedback(response, json_filename="memory.json"):
-    # Create a dictionary with the response
-    feedback_entry = {"feedback": response}
-    
-    # Load existing data from the JSON file if it exists
-    if os.path.exists(json_filename):
-        with open(json_filename, "r") as json_file:
-            data = json.load(json_file)
-    else:
-        data = []
-    
-    # Append the new feedback entry to the data
-    data.append(feedback_entry)
-    
-    # Write the updated data back to the JSON file
-    with open(json_filename, "w") as json_file:
-        json.dump(data, json_file, indent=4)
-
-def read_feedback(json_filename="memory.json"):
-    if os.path.exists(json_filename):
-        with open(json_filename, "r") as json_file:
-            data = json.load(json_file)
-            # Convert the JSON data to a pretty-printed string
-            json_string = json.dumps(data, indent=4)
-            # json_string = str(data)
-            return json_string
-    else:
-        return ""
-    
-def clear_json_file(json_filename="memory.json"):
-    # Open the file in write mode to clear its contents
-    with open(json_filename, "w") as json_file:
-        json.dump([], json_file)
-
-def initialize_json_file(json_filename="memory.json"):
-    if not os.path.exists(json_filename) or os.path.getsize(json_filename) == 0:
-        with open(json_filename, "w") as json_file:
-            json.dump([], json_file)
-
-# Call this function at the beginning of your script
-initialize_json_file()
-
 
 class Agent:
-    def __init__(self, model, model_tool, model_qa, tool, temperature=0, max_tokens=1000, planning_agent_prompt=None, integration_agent_prompt=None, check_response_prompt=None, verbose=False, iterations=5, model_endpoint=None, server=None, stop=None):
+    def __init__(self, model, model_tool, model_qa, tool, temperature=0, max_tokens=1000, planning_agent_prompt=None, integration_agent_prompt=None, check_response_prompt=None, verbose=False, iterations=5, model_endpoint=None, server=None, stop=None, http_client=None, tool_kwargs=None, max_workers=64, stream=False, memory_dir="memory", feedback_context=None, answer_cache=None, completion_memo=None, keep_alive=None, qa_batch_size=1, qa_batch_wait=0.02):
         self.server = server
         self.model_endpoint = model_endpoint
+        self.http_client = http_client or HTTPClient()
 
         if server == 'openai':
             load_config('config.yaml')
             self.api_key = os.getenv('OPENAI_API_KEY')
-            self.headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {self.api_key}'
-        }
         else:
-            self.headers = {"Content-Type": "application/json"}
+            self.api_key = None
             
         self.temperature = temperature
         self.max_tokens = max_tokens
@@ -84,267 +47,165 @@ class Agent:
         self.planning_agent_prompt = planning_agent_prompt
         self.integration_agent_prompt = integration_agent_prompt
         self.model = model
-        self.tool = tool(model=model_tool, verbose=verbose, model_endpoint=model_endpoint, server=server, stop=stop)
+        # Optional CompletionMemo shared by the agent's and the tool's temperature 0 LLM calls
+        self.completion_memo = completion_memo
+        self.tool = tool(model=model_tool, verbose=verbose, model_endpoint=model_endpoint, server=server, stop=stop, http_client=self.http_client, completion_memo=completion_memo, **(tool_kwargs or {}))
         self.iterations = iterations
         self.model_qa = model_qa
         self.stop = stop
+        # Stream integration agent tokens as they are generated instead of waiting for the full answer
+        self.stream = stream
+        # Directory for the per-session append-only feedback logs
+        self.memory_dir = memory_dir
+        # Optional FeedbackContext bounding the feedback injected into the planning and QA prompts
+        self.feedback_context = feedback_context
+        # Optional AnswerCache of passing answers, matched on exact and near-duplicate queries
+        self.answer_cache = answer_cache
+        # Worker threads for the blocking LLM, Serper and scrape calls made from Agent.run
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+        # One backend per model, with the static parts of every payload built up front
+        self.llm = get_backend(server, model, model_endpoint, self.http_client, api_key=self.api_key, stop=stop, memo=completion_memo, keep_alive=keep_alive)
+        self.llm_qa = get_backend(server, model_qa, model_endpoint, self.http_client, api_key=self.api_key, stop=stop, memo=completion_memo, keep_alive=keep_alive)
+        # QA checks of concurrent queries sent as one batch of up to qa_batch_size, on servers that support it (vLLM)
+        self.qa_batcher = None
+        if qa_batch_size > 1 and self.llm_qa.supports_batch:
+            self.qa_batcher = RequestBatcher(self.llm_qa, json_schema=check_response_json, parse=parse_json, max_batch=qa_batch_size, max_wait=qa_batch_wait, max_tokens=max_tokens)
+
+        # Static instructions first and the per-call values after them, so servers can cache the prompt prefix
+        self.planning_layout = PromptLayout(planning_agent_prompt or default_planning_agent_prompt, planning_agent_sections, tool_specs=self.tool_specs)
+        self.integration_layout = PromptLayout(integration_agent_prompt or default_integration_agent_prompt, integration_agent_sections, footer=integration_agent_footer)
+        self.check_response_layout = PromptLayout(check_response_prompt or default_check_response_prompt, check_response_sections)
+
+    def current_datetime(self):
+        # With a completion memo the prompts carry only the date, so identical calls made the same day can hit it
+        return get_current_utc_datetime(date_only=self.completion_memo is not None)
 
     def run_planning_agent(self, query, plan=None, feedback=None):
 
-        system_prompt = self.planning_agent_prompt.format(
+        system_prompt, prompt = self.planning_layout.build(
+                query=query,
                 plan=plan,
                 feedback=feedback,
-                tool_specs=self.tool_specs,
-                datetime=get_current_utc_datetime()
+                datetime=self.current_datetime()
             )
-        
-        if self.server == 'ollama':
-            payload = {
-                "model": self.model,
-                "prompt": query,
-                "system": system_prompt,
-                "stream": False,
-                "temperature": 0,
-            }
-
-        if self.server == 'runpod' or self.server == 'openai':
-
-            prefix = self.model.split('/')[0]
-            exception_models = ['microsoft/Phi-3-medium-128k-instruct',
-                                'microsoft/Phi-3-mini-128k-instruct',
-                                'microsoft/Phi-3-medium-4k-instruct',
-                                'microsoft/Phi-3-mini-4k-instruct',
-                                ]
-
-            if prefix == 'mistralai' or self.model in exception_models:
-                payload = {
-                    "model": self.model,
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": f"system_prompt:{system_prompt}\n\n query: {query}"
-                        }
-                    ],
-                    "temperature": 0,
-                    "stop": None
-                }
-            
-            else:
-                payload = {
-                    "model": self.model,
-                    "messages": [
-                        {
-                            "role": "system",
-                            "content": system_prompt
-                        },
-                        {
-                            "role": "user",
-                            "content": query
-                        }
-                    ],
-                    "stream": False,
-                    "temperature": 0,
-                    "stop": self.stop
-                }
-
-            if self.server == 'openai':
-                del payload["stop"]
 
         try:
-            response = requests.post(self.model_endpoint, headers=self.headers, data=json.dumps(payload))
-            print("Response_DEBUG:", response)
-           
-            try:
-                response_dict = response.json()
-            except json.JSONDecodeError as e:
-                response_dict = ast.literal_eval(response)
-
-            if self.server == 'ollama':
-                response = response_dict['response']
-            
-            if self.server == 'runpod' or self.server == 'openai':
-                response = response_dict['choices'][0]['message']['content']
-
+            response = self.llm.complete(system_prompt, prompt)
             print(colored(f"Planning Agent: {response}", 'green'))
             return response
         
         except Exception as e:
-            print("Error in response:", response_dict)
-            return "Error generating plan {e}"
+            print("Error in response:", e)
+            return f"Error generating plan {e}"
         
-    def run_integration_agent(self, query, plan, outputs, reason, previous_response):
+    def run_integration_agent(self, query, plan, outputs, reason, previous_response, on_token=None):
 
-        system_prompt = self.integration_agent_prompt.format(
+        system_prompt, prompt = self.integration_layout.build(
                 outputs=outputs,
                 plan=plan,
                 reason=reason,
                 sources=outputs.get('sources', ''),
                 previous_response=previous_response,
-                datetime=get_current_utc_datetime(),
+                datetime=self.current_datetime(),
                 query=query
             )
-        
-        if self.server == 'ollama':
-            payload = {
-                "model": self.model,
-                "prompt": query,
-                "system": system_prompt,
-                "stream": False,
-                "temperature": 0,
-            }
-
-        if self.server == 'runpod' or self.server == 'openai':
-
-            prefix = self.model.split('/')[0]
-            exception_models = ['microsoft/Phi-3-medium-128k-instruct',
-                                'microsoft/Phi-3-mini-128k-instruct',
-                                'microsoft/Phi-3-medium-4k-instruct',
-                                'microsoft/Phi-3-mini-4k-instruct',
-                                ]
-
-            if prefix == 'mistralai' or self.model in exception_models:
-                payload = {
-                    "model": self.model,
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": f"system_prompt:{system_prompt}\n\n query: {query}"
-                        }
-                    ],
-                    "temperature": 0,
-                    "stop": None
-                }
-            
-            else:
-                payload = {
-                    "model": self.model,
-                    "messages": [
-                        {
-                            "role": "system",
-                            "content": system_prompt
-                        },
-                        {
-                            "role": "user",
-                            "content": query
-                        }
-                    ],
-                    "stream": False,
-                    "temperature": 0,
-                    "stop": self.stop
-                }
-
-            if self.server == 'openai':
-                del payload["stop"]
 
-        try:
-            response = requests.post(self.model_endpoint, headers=self.headers, data=json.dumps(payload))
-            try:
-                response_dict = response.json()
-            except json.JSONDecodeError as e:
-                response_dict = ast.literal_eval(response)
-
-            if self.server == 'ollama':
-                response = response_dict['response']
-            
-            if self.server == 'runpod' or self.server == 'openai':
-                response = response_dict['choices'][0]['message']['content']
+        if self.stream:
+            return self.stream_integration_agent(system_prompt, prompt, on_token=on_token)
 
+        try:
+            response = self.llm.complete(system_prompt, prompt)
             print(colored(f"Integration Agent: {response}", 'cyan'))
 
             return response
         
         except Exception as e:
-            print("Error in response:", response_dict)
-            return "Error generating plan {e}"
-    
-    def check_response(self, response, query, previous_response, datetime=get_current_utc_datetime()):
-
-        if self.server == 'ollama':
-            payload = {
-                "model": self.model_qa,
-                "prompt": f"query: {query}\n\nresponse: {response}",
-                "format": "json",
-                "system": check_response_prompt,
-                "stream": False,
-                "temperature": 0,
-                "stop": self.stop
-            }
-
-        if self.server == 'runpod' or self.server == 'openai':
-
-            prefix = self.model.split('/')[0]
-            exception_models = ['microsoft/Phi-3-medium-128k-instruct',
-                                'microsoft/Phi-3-mini-128k-instruct',
-                                'microsoft/Phi-3-medium-4k-instruct',
-                                'microsoft/Phi-3-mini-4k-instruct',
-                                ]
-
-            if prefix == 'mistralai' or self.model in exception_models:
-                payload = {
-                    "model": self.model_qa,
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": f"system:{check_response_prompt}\n\n query: {query}\n\nresponse: {response} \n\n previous response: {previous_response} \n\n current datetime: {datetime}"
-                        }
-                    ],
-                    "temperature": 0,
-                    "stop": None,
-                    "guided_json": check_response_json
-                }
+            print("Error in response:", e)
+            return f"Error generating response {e}"
+
+    def stream_integration_agent(self, system_prompt, prompt, on_token=None):
+        # Tokens are handed to on_token as they arrive; the joined text is returned once the stream completes
+        if on_token is None:
+            print(colored("Integration Agent: ", 'cyan'), end='', flush=True)
+            on_token = lambda token: print(colored(token, 'cyan'), end='', flush=True)
+
+        tokens = []
+        try:
+            for token in self.llm.stream(system_prompt, prompt):
+                tokens.append(token)
+                on_token(token)
+            print()
+            return ''.join(tokens)
 
+        except Exception as e:
+            print(f"Error in streamed response: {e}")
+            return ''.join(tokens) or f"Error generating response {e}"
+
+    def check_response(self, response, query, previous_response, datetime=None):
+        system_prompt, prompt = self.check_response_layout.build(query=query, previous_response=previous_response, response=response, datetime=datetime or self.current_datetime())
+
+        try:
+            if self.qa_batcher is not None:
+                decision_dict = self.qa_batcher.submit(system_prompt, prompt)
             else:
-                payload = {
-                    "model": self.model,
-                    "response_format": {"type": "json_object"},
-                    "messages": [
-                        {
-                            "role": "system",
-                            "content": check_response_prompt
-                        },
-                        {
-                            "role": "user",
-                            "content": f"query: {query} \n\nresponse: {response} \n\nprevious response: {previous_response} \n\n current datetime: {datetime}"
-                        }
-                    ],
-                    "temperature": 0,
-                    "stop": self.stop,
-                    "guided_json": check_response_json
-                }
-
-            if self.server == 'openai':
-                del payload["stop"]
-                del payload["guided_json"]
-
-        try: 
-            response = requests.post(self.model_endpoint, headers=self.headers, data=json.dumps(payload))  
-            try:
-                response_dict = response.json()
-            except json.JSONDecodeError as e:
-                response_dict = ast.literal_eval(response)
-
-            print(f"check_response response_dict type: {type(response_dict)}")
-
-            if self.server == 'ollama':
-                decision_dict = json.loads(response_dict['response'])
-
-            if self.server == 'runpod' or self.server == 'openai':
-                response_content = response_dict['choices'][0]['message']['content']
-
-                try:
-                    decision_dict = json.loads(response_content)
-                except json.JSONDecodeError as e:
-                    decision_dict = ast.literal_eval(response_content)
-            
+                decision_dict = self.llm_qa.complete_json(system_prompt, prompt, json_schema=check_response_json)
             print("Response Quality Assessment:", decision_dict)
             return decision_dict
         
         except Exception as e:
-            print("Error in assessing response quality:", response_dict)
+            print("Error in assessing response quality:", e)
             return "Error in assessing response quality"
-         
-    def execute(self):
-        query = input("Enter your query: ")
+
+    async def _run_in_thread(self, func, *args, **kwargs):
+        # Blocking HTTP calls run on the agent's thread pool so the event loop can multiplex many queries
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.executor, functools.partial(context.run, func, *args, **kwargs))
+
+    async def _run_stage(self, name, func, *args, iteration=None, **kwargs):
+        # Times one stage of the loop as a span nested under the query's agent.run span
+        with tracing.span(name, iteration=iteration):
+            return await self._run_in_thread(func, *args, **kwargs)
+
+    async def run(self, query, on_token=None, on_attempt=None):
+        # on_attempt(iteration) is called as each integration pass starts, so a consumer of on_token can tell
+        # a new draft from the one QA just rejected
+        with tracing.span("agent.run", query=query) as span:
+            if self.answer_cache is not None:
+                result = await self._run_in_thread(self.cached_answer, query, on_token=on_token)
+                span.set_attributes(answer_cache_hit=result is not None)
+                if result is not None:
+                    return result
+
+            result = await self._run(query, on_token=on_token, on_attempt=on_attempt)
+            span.set_attributes(iterations=result["iterations"], passed=result["passed"])
+
+            if self.answer_cache is not None and result["passed"]:
+                await self._run_in_thread(self.answer_cache.set, query, result["response"], sources=result["sources"])
+            return result
+
+    def cached_answer(self, query, on_token=None):
+        # A previous passing answer to the same or a reworded query, returned as a run result
+        answer = self.answer_cache.get(query)
+        if answer is None:
+            return None
+
+        print(colored(f"Answer cache hit for: {answer['query']}", 'green'))
+        if on_token is not None:
+            on_token(answer["response"])
+        return {
+            "query": query,
+            "response": answer["response"],
+            "passed": True,
+            "iterations": 0,
+            "sources": answer["sources"],
+            "cached": True
+        }
+
+    async def _run(self, query, on_token=None, on_attempt=None):
+        # Each query gets its own memory, so concurrent runs never share feedback or files
+        memory = MemoryStore(directory=self.memory_dir)
         meets_requirements = False
         plan = None
         outputs = None
@@ -354,30 +215,64 @@ class Agent:
         visited_sites = []
         failed_sites = []
     
-        while not meets_requirements and iterations < self.iterations:
-            iterations += 1
-            feedback = read_feedback(json_filename="memory.json")
-            plan = self.run_planning_agent(query, plan=plan, feedback=feedback)
-            outputs = self.tool.use_tool(plan=plan, query=query, visited_sites=visited_sites, failed_sites=failed_sites)
-            visited_sites.append(outputs.get('source', ''))
-            print("VISITED_SITES",visited_sites)
-
-            integration_agent_response = self.run_integration_agent(query=query, plan=plan, outputs=outputs, reason=reason, previous_response=feedback)
-            save_feedback(integration_agent_response, json_filename="memory.json")
-            response_dict = self.check_response(response=integration_agent_response, query=query, previous_response=feedback)
-            meets_requirements = response_dict.get('pass', '')
-            print(f"Response meets requirements: {meets_requirements}")
-            if meets_requirements == 'True':
-                meets_requirements = True
-            else: 
-                meets_requirements = False
-                reason = response_dict.get('reason', '')
-
-        clear_json_file()
-        print(colored(f"Final Response: {integration_agent_response}", 'cyan'))
+        # Search for the raw query while the first plan is being generated
+        prefetched = self.tool.prefetch(query) if getattr(self.tool, 'prefetch_search', False) else None
+    
+        # The session's feedback file is removed however the run ends, including on errors and on
+        # cancellation by a deadline (asyncio.wait_for in the service and batch runners)
+        try:
+            while not meets_requirements and iterations < self.iterations:
+                iterations += 1
+                if self.feedback_context is not None:
+                    feedback, feedback_tokens = memory.build_context(self.feedback_context)
+                    tracing.set_attributes(feedback_tokens=feedback_tokens)
+                    print(f"Feedback context: {feedback_tokens} tokens")
+                else:
+                    feedback = memory.read_feedback()
+                plan = await self._run_stage("planning", self.run_planning_agent, query, iteration=iterations, plan=plan, feedback=feedback)
+                outputs = await self._run_stage("search", self.tool.use_tool, iteration=iterations, plan=plan, query=query, visited_sites=visited_sites, failed_sites=failed_sites, prefetched=prefetched)
+                prefetched = None
+                if outputs.get('sources'):
+                    visited_sites.extend(outputs['sources'])
+                else:
+                    visited_sites.append(outputs.get('source', ''))
+                print("VISITED_SITES",visited_sites)
+
+                if on_attempt is not None:
+                    on_attempt(iterations)
+                integration_agent_response = await self._run_stage("integration", self.run_integration_agent, iteration=iterations, query=query, plan=plan, outputs=outputs, reason=reason, previous_response=feedback, on_token=on_token)
+                memory.save_feedback(integration_agent_response)
+                response_dict = await self._run_stage("qa", self.check_response, iteration=iterations, response=integration_agent_response, query=query, previous_response=feedback)
+                if not isinstance(response_dict, dict):
+                    response_dict = {"pass": "False", "reason": response_dict}
+                meets_requirements = response_dict.get('pass', '')
+                print(f"Response meets requirements: {meets_requirements}")
+                if meets_requirements == 'True':
+                    meets_requirements = True
+                else: 
+                    meets_requirements = False
+                    reason = response_dict.get('reason', '')
+
+        finally:
+            memory.clear()
+
+        return {
+            "query": query,
+            "response": integration_agent_response,
+            "passed": meets_requirements,
+            "iterations": iterations,
+            "sources": visited_sites
+        }
+
+    def execute(self):
+        query = input("Enter your query: ")
+        result = asyncio.run(self.run(query))
+        print(colored(f"Final Response: {result['response']}", 'cyan'))
+        return result
 
         
-if __name__ == '__main__':
+def build_agent():
+    # The agent as configured for this deployment, shared by the interactive, service and batch entry points
 
     # Params for Ollama
     # model = "llama3:instruct"
@@ -405,19 +300,49 @@ if __name__ == '__main__':
     stop = None
     server = 'openai'
 
+    # Export per-stage spans to a JSONL file
+    tracing.configure(path="traces/spans.jsonl")
+
+    # Shared connection pool for the LLM endpoint, serper.dev and scraped sites
+    http_client = HTTPClient(pool_connections=10, pool_maxsize=20, timeout=120, retries=3, backoff_factor=0.5)
+
     agent = Agent(model=model,
                   model_tool=model_tool,
                   model_qa=model_qa,
                   tool=WebSearcher, 
-                  planning_agent_prompt=planning_agent_prompt, 
-                  integration_agent_prompt=integration_agent_prompt,
+                  planning_agent_prompt=default_planning_agent_prompt,
+                  integration_agent_prompt=default_integration_agent_prompt,
                   verbose=False,
                   iterations=6,
                   model_endpoint=model_endpoint,
-                  server=server
-                  )              
-    agent.execute()
+                  server=server,
+                  http_client=http_client,
+                  stream=True,
+                  feedback_context=FeedbackContext(max_tokens=1500, recent_entries=2),
+                  # Answer repeated and reworded queries from earlier passing answers
+                  answer_cache=AnswerCache(ttl=7 * 24 * 60 * 60, short_ttl=60 * 60),
+                  # Reuse identical temperature 0 completions, in memory and on disk
+                  completion_memo=CompletionMemo(max_entries=1024, disk=True),
+                  # For Ollama: keep the model and its prompt cache loaded between calls
+                  keep_alive="30m",
+                  # For vLLM (RunPod): send the QA checks of up to 8 concurrent queries as one batch
+                  qa_batch_size=8,
+                  # Scrape the top 3 search results concurrently instead of one page at a time
+                  tool_kwargs={"parallel_pages": 3, "page_deadline": 20, "speculative_pages": 2, "prefetch_search": True,
+                               # Fetch three diverse searches per step and merge their results
+                               "num_searches": 3,
+                               # Send the integration agent the page passages most relevant to the query
+                               "passage_tokens": 2000,
+                               # Pick the page locally when the choice is clear, asking the LLM otherwise
+                               "page_selector": True,
+                               # Remember across runs which domains time out or block scrapers
+                               "domain_health": True,
+                               "search_cache": SearchCache(ttl=24 * 60 * 60), "page_cache": PageCache(ttl=60 * 60)}
+                  )
+    return agent
 
 
-    
+if __name__ == '__main__':
 
+    agent = build_agent()
+    agent.execute()
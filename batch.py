@@ -0,0 +1,149 @@
+"""
+Batch mode: runs every query of a JSONL file through the agent, several at a time.
+
+    python batch.py queries.jsonl results.jsonl --concurrency 8
+
+Each input line is a JSON object holding the query (field set by --query-field) and optionally an id
+(--id-field, defaulting to the line number). Results are appended to the output file as each query
+finishes, so an interrupted run started again with the same output file skips the queries already answered
+(queries that failed are retried, and the last line for an id is the one that counts).
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import contextlib
+from agent import build_agent
+
+
+def read_queries(path, query_field="query", id_field="id"):
+    queries = []
+    with open(path, 'r') as input_file:
+        for line_number, line in enumerate(input_file, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            queries.append((str(record.get(id_field, line_number)), record[query_field]))
+    return queries
+
+
+def read_done(path):
+    # Ids answered in the output file; failed queries and lines cut short by a crash run again
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, 'r') as output_file:
+        for line in output_file:
+            try:
+                record = json.loads(line)
+                if record.get("error") is None:
+                    done.add(record["id"])
+            except (json.JSONDecodeError, KeyError, AttributeError):
+                continue
+    return done
+
+
+def ends_with_newline(path):
+    with open(path, 'rb') as output_file:
+        output_file.seek(-1, os.SEEK_END)
+        return output_file.read(1) == b"\n"
+
+
+class BatchRunner:
+    """
+    Runs queries through one shared Agent (and so its connection pools and caches) with at most
+    `concurrency` in flight, appending each result to the output JSONL file as soon as it is ready.
+    """
+    def __init__(self, agent, output_path, concurrency=4, deadline=None, report_every=10):
+        self.agent = agent
+        self.output_path = output_path
+        self.concurrency = concurrency
+        self.deadline = deadline
+        self.report_every = report_every
+        self.completed = 0
+        self.failed = 0
+
+    async def run_query(self, query_id, query):
+        start = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(self.agent.run(query, on_token=lambda token: None), timeout=self.deadline)
+            record = dict(result, id=query_id, error=None)
+        except asyncio.TimeoutError:
+            record = {"id": query_id, "query": query, "error": f"Deadline of {self.deadline}s exceeded"}
+        except Exception as e:
+            record = {"id": query_id, "query": query, "error": str(e)}
+        record["elapsed_s"] = round(time.perf_counter() - start, 3)
+        return record
+
+    def write(self, output_file, record):
+        output_file.write(json.dumps(record, default=str) + "\n")
+        output_file.flush()
+        os.fsync(output_file.fileno())
+
+    async def run(self, queries):
+        """
+        Runs the queries not already in the output file and returns the run's statistics.
+        """
+        done = read_done(self.output_path)
+        pending = [(query_id, query) for query_id, query in queries if query_id not in done]
+        log(f"{len(queries)} queries, {len(queries) - len(pending)} already done, {len(pending)} to run with concurrency {self.concurrency}")
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        start = time.perf_counter()
+
+        with open(self.output_path, 'a') as output_file:
+            if output_file.tell() and not ends_with_newline(self.output_path):
+                # Terminate a line cut short by a crash so the next record starts on its own line
+                output_file.write("\n")
+
+            async def run_one(query_id, query):
+                async with semaphore:
+                    record = await self.run_query(query_id, query)
+                # Written from the event loop thread only, so lines never interleave
+                self.write(output_file, record)
+                self.completed += 1
+                self.failed += record["error"] is not None
+                if self.completed % self.report_every == 0 or self.completed == len(pending):
+                    log(self.progress(len(pending), time.perf_counter() - start))
+
+            await asyncio.gather(*(run_one(query_id, query) for query_id, query in pending))
+
+        elapsed = time.perf_counter() - start
+        return {
+            "queries": len(pending),
+            "skipped": len(queries) - len(pending),
+            "failed": self.failed,
+            "elapsed_s": round(elapsed, 3),
+            "queries_per_hour": round(self.completed / elapsed * 3600, 1) if elapsed and self.completed else 0.0,
+        }
+
+    def progress(self, total, elapsed):
+        rate = self.completed / elapsed * 3600 if elapsed else 0
+        return f"{self.completed}/{total} done ({self.failed} failed), {rate:.0f} queries/hour"
+
+
+def log(message):
+    # Progress goes to stderr so it stays visible when the agent's own output is silenced
+    print(message, file=sys.stderr, flush=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help="JSONL file of queries")
+    parser.add_argument('output', help="JSONL file the results are appended to")
+    parser.add_argument('--concurrency', type=int, default=4, help="queries run at the same time")
+    parser.add_argument('--query-field', default='query')
+    parser.add_argument('--id-field', default='id')
+    parser.add_argument('--deadline', type=float, default=None, help="maximum seconds per query")
+    parser.add_argument('--report-every', type=int, default=10, help="print progress every N queries")
+    parser.add_argument('--quiet', action='store_true', help="hide the agent's output, showing only progress")
+    args = parser.parse_args()
+
+    queries = read_queries(args.input, query_field=args.query_field, id_field=args.id_field)
+    runner = BatchRunner(build_agent(), args.output, concurrency=args.concurrency, deadline=args.deadline, report_every=args.report_every)
+
+    with contextlib.redirect_stdout(open(os.devnull, 'w')) if args.quiet else contextlib.nullcontext():
+        stats = asyncio.run(runner.run(queries))
+    log(json.dumps(stats))
@@ -0,0 +1,207 @@
+import re
+import json
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+WORDS = ("the sky appears blue because molecules in the atmosphere scatter shorter wavelengths of sunlight "
+         "more strongly than longer wavelengths which is known as rayleigh scattering").split()
+
+
+def make_paragraphs(words, text=None):
+    text = text or ' '.join(WORDS[i % len(WORDS)] for i in range(words))
+    step = 80
+    tokens = text.split()
+    return ''.join(f"<p>{' '.join(tokens[i:i + step])}</p>\n" for i in range(0, len(tokens), step))
+
+
+def make_page(title, words, text=None, charset_meta=None):
+    meta = f'<meta charset="{charset_meta}">' if charset_meta else ''
+    boilerplate = '<nav>' + ' '.join(f'<a href="/{i}">Link {i}</a>' for i in range(200)) + '</nav>'
+    script = '<script>' + 'var data = [' + ','.join(str(i) for i in range(5000)) + '];</script>'
+    return (f"<html><head>{meta}<title>{title}</title>{script}<style>body {{ color: black; }}</style></head>"
+            f"<body>{boilerplate}<h1>{title}</h1>{make_paragraphs(words, text)}<footer>Copyright</footer></body></html>")
+
+
+def build_corpus():
+    """
+    Static pages of varied sizes and encodings, as (body, content type) keyed by path.
+    """
+    latin = "Le ciel paraît bleu à cause de la diffusion Rayleigh, qui disperse davantage la lumière bleue. " * 40
+    cyrillic = "Небо кажется голубым из-за рэлеевского рассеяния солнечного света в атмосфере. " * 40
+    return {
+        "/small": (make_page("Small page", 300).encode('utf-8'), "text/html; charset=utf-8"),
+        "/medium": (make_page("Medium page", 5000).encode('utf-8'), "text/html; charset=utf-8"),
+        "/large": (make_page("Large page", 400000).encode('utf-8'), "text/html; charset=utf-8"),
+        "/large-no-charset": (make_page("Large page", 400000).encode('utf-8'), "text/html"),
+        "/latin1": (make_page("Page latin-1", 0, text=latin).encode('latin-1'), "text/html"),
+        "/cp1251-meta": (make_page("Страница", 0, text=cyrillic, charset_meta="windows-1251").encode('cp1251'), "text/html"),
+        "/pdf": (b"%PDF-1.4\n" + bytes(range(256)) * 4000, "application/pdf"),
+    }
+
+
+class QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def send_body(self, status, body, content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The scraper closes the connection once it has enough text
+            pass
+
+
+class FakeLLMHandler(QuietHandler):
+    """
+    OpenAI/vLLM chat completions and Ollama /api/generate stand-in, plus vLLM's /tokenize and batched
+    /v1/completions (the mock "tokens" are the bytes of the JSON messages, so a batch can be answered).
+    Replies are chosen from the system prompt so every stage of the agent gets a well-formed answer,
+    after sleeping for the server's configured latency. The size of each completions batch is recorded.
+    """
+    @staticmethod
+    def split_messages(messages):
+        system_prompt = ' '.join(m['content'] for m in messages if m['role'] == 'system') or messages[0]['content']
+        return system_prompt, messages[-1]['content']
+
+    def reply(self, system_prompt, prompt):
+        if 'several inputs to a google search engine' in system_prompt:
+            return json.dumps({"response": ["why is the sky blue", "rayleigh scattering sky colour", "Why is the sky  BLUE"]})
+        if 'google search engine' in system_prompt:
+            return json.dumps({"response": "why is the sky blue"})
+        if 'best website source' in system_prompt:
+            links = re.findall(r'Link: (\S+)', prompt)
+            return json.dumps({"response": links[0] if links else ""})
+        if 'Check if the response' in system_prompt:
+            return json.dumps({"pass": "True", "relevant": "Relevant", "coherent": "Coherent",
+                               "comprehensive": "Comprehensive", "citations": "Citations", "reason": "ok"})
+        if 'Integration Agent' in system_prompt:
+            return "The sky is blue because of Rayleigh scattering. Sources: " + ' '.join(WORDS) * 3
+        return "1. Search for why the sky is blue."
+
+    def do_POST(self):
+        payload = self.read_json()
+
+        if self.path.endswith('/tokenize'):
+            tokens = list(json.dumps(payload['messages']).encode('utf-8'))
+            return self.send_body(200, json.dumps({"tokens": tokens, "count": len(tokens)}).encode())
+
+        time.sleep(self.server.latency)
+
+        if self.path.endswith('/v1/completions'):
+            self.server.batch_sizes.append(len(payload['prompt']))
+            choices = []
+            for index, tokens in enumerate(payload['prompt']):
+                messages = json.loads(bytes(tokens).decode('utf-8'))
+                choices.append({"index": index, "text": self.reply(*self.split_messages(messages))})
+            usage = {"prompt_tokens": sum(map(len, payload['prompt'])) // 4, "completion_tokens": sum(len(choice["text"]) for choice in choices) // 4}
+            return self.send_body(200, json.dumps({"choices": choices[::-1], "usage": usage}).encode())
+
+        if 'messages' in payload:
+            system_prompt, prompt = self.split_messages(payload['messages'])
+        else:
+            system_prompt, prompt = payload.get('system', ''), payload.get('prompt', '')
+
+        content = self.reply(system_prompt, prompt)
+        usage = {"prompt_tokens": len(json.dumps(payload)) // 4, "completion_tokens": len(content) // 4}
+        # Like vLLM and OpenAI, report a system prompt seen before as served from the prefix cache
+        usage["prompt_tokens_details"] = {"cached_tokens": len(system_prompt) // 4 if system_prompt in self.server.seen_prompts else 0}
+        self.server.seen_prompts.add(system_prompt)
+
+        if self.path.endswith('/api/generate'):
+            if payload.get('stream'):
+                lines = [json.dumps({"response": word + ' ', "done": False}) for word in content.split(' ')]
+                lines.append(json.dumps({"done": True, "prompt_eval_count": usage["prompt_tokens"], "eval_count": usage["completion_tokens"]}))
+                return self.send_body(200, ('\n'.join(lines) + '\n').encode(), 'application/x-ndjson')
+            return self.send_body(200, json.dumps({"response": content, "prompt_eval_count": usage["prompt_tokens"], "eval_count": usage["completion_tokens"]}).encode())
+
+        if payload.get('stream'):
+            events = [f"data: {json.dumps({'choices': [{'delta': {'content': word + ' '}}]})}\n\n" for word in content.split(' ')]
+            events.append(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n")
+            events.append("data: [DONE]\n\n")
+            return self.send_body(200, ''.join(events).encode(), 'text/event-stream')
+
+        return self.send_body(200, json.dumps({"choices": [{"message": {"content": content}}], "usage": usage}).encode())
+
+
+class FakeSerperHandler(QuietHandler):
+    """
+    serper.dev stand-in returning organic results that point at the corpus server.
+    """
+    def do_POST(self):
+        query = self.read_json().get('q', '')
+        time.sleep(self.server.latency)
+        organic = [
+            {"title": f"{path.strip('/')} result", "link": self.server.corpus_url + path,
+             "snippet": f"Result for {query}", "position": position}
+            for position, path in enumerate(self.server.result_paths, start=1)
+        ]
+        self.send_body(200, json.dumps({"organic": organic}).encode())
+
+
+class CorpusHandler(QuietHandler):
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        if self.path not in self.server.corpus:
+            return self.send_body(404, b"Not found", "text/plain")
+        body, content_type = self.server.corpus[self.path]
+        self.send_body(200, body, content_type)
+
+
+class QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up early (the scraper's byte and word budgets) are expected
+        pass
+
+
+def start_server(handler, **attributes):
+    server = QuietServer(('127.0.0.1', 0), handler)
+    for key, value in attributes.items():
+        setattr(server, key, value)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class MockServices:
+    """
+    Starts the fake LLM, fake Serper and static corpus servers on free local ports.
+    Use as a context manager; the endpoints are available as attributes once started.
+    """
+    def __init__(self, llm_latency=0.05, serper_latency=0.02, page_latency=0.01, result_paths=("/medium", "/small", "/large")):
+        self.llm_latency = llm_latency
+        self.serper_latency = serper_latency
+        self.page_latency = page_latency
+        self.result_paths = list(result_paths)
+        self.corpus = build_corpus()
+        self.servers = []
+
+    def __enter__(self):
+        corpus = start_server(CorpusHandler, corpus=self.corpus, latency=self.page_latency)
+        self.corpus_url = f"http://127.0.0.1:{corpus.server_address[1]}"
+        serper = start_server(FakeSerperHandler, corpus_url=self.corpus_url, result_paths=self.result_paths, latency=self.serper_latency)
+        llm = start_server(FakeLLMHandler, latency=self.llm_latency, seen_prompts=set(), batch_sizes=[])
+        self.llm_batch_sizes = llm.batch_sizes
+        self.servers = [corpus, serper, llm]
+
+        self.search_endpoint = f"http://127.0.0.1:{serper.server_address[1]}/search"
+        self.openai_endpoint = f"http://127.0.0.1:{llm.server_address[1]}/v1/chat/completions"
+        self.ollama_endpoint = f"http://127.0.0.1:{llm.server_address[1]}/api/generate"
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,192 @@
+"""
+Offline benchmarks for the agent, using local stand-ins for the LLM server, serper.dev and websites.
+
+    python benchmarks/run_benchmarks.py --queries 20 --concurrency 5
+    python benchmarks/run_benchmarks.py --stages extraction scrape --memory --output results.json
+"""
+import os
+import io
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tracemalloc
+import contextlib
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+# The Agent and WebSearcher read config.yaml from the working directory
+os.chdir(REPO_ROOT)
+
+from mock_servers import MockServices, build_corpus
+from agent import Agent
+from search import WebSearcher
+from http_client import HTTPClient
+from extract import extract_text, EXTRACTORS
+from text_quality import is_garbled
+from prompts import planning_agent_prompt, integration_agent_prompt
+
+
+STAGES = ('end_to_end', 'use_tool', 'scrape', 'extraction', 'garbled')
+
+
+def summarize(name, latencies, elapsed, peak_bytes=None):
+    latencies = sorted(latencies)
+
+    def percentile(p):
+        return latencies[min(int(round(p * (len(latencies) - 1))), len(latencies) - 1)] * 1000
+
+    result = {
+        "stage": name,
+        "runs": len(latencies),
+        "throughput_per_s": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+        "p50_ms": round(percentile(0.5), 2),
+        "p95_ms": round(percentile(0.95), 2),
+        "p99_ms": round(percentile(0.99), 2),
+    }
+    if peak_bytes is not None:
+        result["peak_memory_mb"] = round(peak_bytes / 1e6, 2)
+    return result
+
+
+@contextlib.contextmanager
+def measure(memory):
+    # Yields a dict that receives the elapsed time and, with memory tracking, the peak traced allocation
+    stats = {}
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield stats
+    finally:
+        stats["elapsed"] = time.perf_counter() - start
+        if memory:
+            stats["peak"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def make_agent(services, args):
+    endpoint = services.ollama_endpoint if args.server == 'ollama' else services.openai_endpoint
+    return Agent(model='mock-model', model_tool='mock-model', model_qa='mock-model', tool=WebSearcher,
+                 planning_agent_prompt=planning_agent_prompt, integration_agent_prompt=integration_agent_prompt,
+                 iterations=1, model_endpoint=endpoint, server=args.server, stream=args.stream,
+                 http_client=HTTPClient(pool_maxsize=max(args.concurrency * 4, 10)),
+                 max_workers=max(args.concurrency * 2, 4), qa_batch_size=args.qa_batch_size,
+                 tool_kwargs={"search_endpoint": services.search_endpoint, "extractor": args.extractor,
+                              "parallel_pages": args.parallel_pages, "num_searches": args.num_searches})
+
+
+def bench_end_to_end(services, args):
+    agent = make_agent(services, args)
+
+    async def run_all():
+        semaphore = asyncio.Semaphore(args.concurrency)
+        latencies = []
+
+        async def run_one(i):
+            async with semaphore:
+                start = time.perf_counter()
+                await agent.run(f"Why is the sky blue? ({i})")
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(run_one(i) for i in range(args.queries)))
+        return latencies
+
+    with measure(args.memory) as stats:
+        latencies = asyncio.run(run_all())
+    return summarize(f"end_to_end (concurrency {args.concurrency})", latencies, stats["elapsed"], stats.get("peak"))
+
+
+def bench_use_tool(services, args):
+    tool = make_agent(services, args).tool
+    with measure(args.memory) as stats:
+        latencies = [timed(tool.use_tool, plan="Search for why the sky is blue.", query="Why is the sky blue?") for _ in range(args.queries)]
+    return summarize("use_tool", latencies, stats["elapsed"], stats.get("peak"))
+
+
+def bench_scrape(services, args):
+    tool = make_agent(services, args).tool
+    results = []
+    for path in services.corpus:
+        url = services.corpus_url + path
+        with measure(args.memory) as stats:
+            latencies = [timed(tool.scrape_website_content, url) for _ in range(args.runs)]
+        results.append(summarize(f"scrape {path}", latencies, stats["elapsed"], stats.get("peak")))
+    return results
+
+
+def bench_extraction(services, args):
+    results = []
+    for path, (body, content_type) in build_corpus().items():
+        if not content_type.startswith('text/html'):
+            continue
+        content = body.decode('cp1251' if 'cp1251' in path else 'latin-1' if 'latin1' in path else 'utf-8')
+        for engine in EXTRACTORS:
+            with measure(args.memory) as stats:
+                latencies = [timed(extract_text, content, engine=engine) for _ in range(args.runs)]
+            results.append(summarize(f"extract {engine} {path} ({len(body) / 1e6:.2f} MB)", latencies, stats["elapsed"], stats.get("peak")))
+    return results
+
+
+def bench_garbled(services, args):
+    text = ' '.join(extract_text(build_corpus()["/large"][0].decode('utf-8'), max_words=10 ** 7).split())
+    with measure(args.memory) as stats:
+        latencies = [timed(is_garbled, text) for _ in range(args.runs)]
+    return summarize(f"is_garbled ({len(text) / 1e6:.1f}M chars)", latencies, stats["elapsed"], stats.get("peak"))
+
+
+BENCHMARKS = {
+    'end_to_end': bench_end_to_end,
+    'use_tool': bench_use_tool,
+    'scrape': bench_scrape,
+    'extraction': bench_extraction,
+    'garbled': bench_garbled,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--queries', type=int, default=20, help="queries for end_to_end and use_tool")
+    parser.add_argument('--concurrency', type=int, default=5)
+    parser.add_argument('--runs', type=int, default=5, help="repetitions for scrape, extraction and garbled")
+    parser.add_argument('--server', choices=('openai', 'runpod', 'ollama'), default='runpod')
+    parser.add_argument('--stream', action='store_true', help="stream the integration agent")
+    parser.add_argument('--extractor', choices=EXTRACTORS, default='fast')
+    parser.add_argument('--parallel-pages', type=int, default=0)
+    parser.add_argument('--num-searches', type=int, default=1, help="searches fanned out per step")
+    parser.add_argument('--qa-batch-size', type=int, default=1, help="QA checks of concurrent queries sent as one vLLM batch (runpod only)")
+    parser.add_argument('--llm-latency', type=float, default=0.05, help="seconds per fake LLM call")
+    parser.add_argument('--serper-latency', type=float, default=0.02)
+    parser.add_argument('--page-latency', type=float, default=0.01)
+    parser.add_argument('--memory', action='store_true', help="track peak memory with tracemalloc (slower)")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    # The fake Serper ignores the key, but the WebSearcher requires one to be set
+    os.environ.setdefault('SERPER_DEV_API_KEY', 'benchmark')
+
+    results = []
+    with MockServices(llm_latency=args.llm_latency, serper_latency=args.serper_latency, page_latency=args.page_latency) as services:
+        for stage in args.stages:
+            result = BENCHMARKS[stage](services, args)
+            for row in (result if isinstance(result, list) else [result]):
+                results.append(row)
+                print(json.dumps(row))
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=4)
+
+
+if __name__ == '__main__':
+    main()
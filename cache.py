@@ -0,0 +1,382 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from minhash import MinHash, NEGATION_WORDS, content_words
+
+
+def normalize_query(query):
+    # Case and whitespace differences should not produce separate cache entries
+    return ' '.join(str(query).lower().split())
+
+
+class SQLiteCache:
+    """
+    Persistent key/value cache backed by SQLite.
+    Values are stored as JSON with their creation and last access times. Entries older than the TTL are
+    treated as misses and are deleted once older than max_age (defaults to the TTL), and the least
+    recently used entries are evicted once the cache grows beyond max_entries or max_bytes.
+    The database runs in WAL mode so several processes can share one file.
+    """
+    table = "cache"
+
+    def __init__(self, path, ttl=None, max_entries=10000, max_bytes=None, max_age=None):
+        self.path = path
+        self.ttl = ttl
+        self.max_age = max_age if max_age is not None else ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_last_access ON {self.table} (last_access)")
+
+    def is_fresh(self, created_at, now):
+        return self.ttl is None or now - created_at <= self.ttl
+
+    def get_entry(self, key):
+        # Returns (value, fresh) for the key, or None if it is not cached at all
+        now = time.time()
+        with self.lock, self.conn:
+            row = self.conn.execute(f"SELECT value, created_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(f"UPDATE {self.table} SET last_access = ? WHERE key = ?", (now, key))
+        return json.loads(row[0]), self.is_fresh(row[1], now)
+
+    def get(self, key):
+        entry = self.get_entry(key)
+        hit = entry is not None and entry[1]
+        self.record(hit)
+        return entry[0] if hit else None
+
+    def record(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def set(self, key, value):
+        data = json.dumps(value)
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), now, now)
+            )
+            self.evict()
+
+    def touch(self, key):
+        # Mark an entry as fresh again without rewriting its value
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(f"UPDATE {self.table} SET created_at = ?, last_access = ? WHERE key = ?", (now, now, key))
+
+    def evict(self):
+        # Called with the lock held, inside a transaction
+        if self.max_age is not None:
+            self.conn.execute(f"DELETE FROM {self.table} WHERE created_at < ?", (time.time() - self.max_age,))
+
+        if self.max_entries is not None:
+            count = self.conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+            if count > self.max_entries:
+                self.conn.execute(
+                    f"DELETE FROM {self.table} WHERE key IN "
+                    f"(SELECT key FROM {self.table} ORDER BY last_access ASC LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+
+        if self.max_bytes is not None:
+            total = self.conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.table}").fetchone()[0]
+            if total > self.max_bytes:
+                rows = self.conn.execute(f"SELECT key, size FROM {self.table} ORDER BY last_access ASC").fetchall()
+                stale = []
+                for key, size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    stale.append((key,))
+                    total -= size
+                self.conn.executemany(f"DELETE FROM {self.table} WHERE key = ?", stale)
+
+    def clear(self):
+        with self.lock, self.conn:
+            self.conn.execute(f"DELETE FROM {self.table}")
+
+    def stats(self):
+        with self.lock:
+            entries, size = self.conn.execute(f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.table}").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": size
+        }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class SearchCache(SQLiteCache):
+    """
+    Cache of Serper organic results keyed on the normalized search query.
+    """
+    table = "search_results"
+
+    def __init__(self, path="cache/search_cache.sqlite", ttl=24 * 60 * 60, max_entries=10000, max_bytes=None):
+        super().__init__(path, ttl=ttl, max_entries=max_entries, max_bytes=max_bytes)
+
+    def get(self, query):
+        return super().get(normalize_query(query))
+
+    def set(self, query, organic_results):
+        super().set(normalize_query(query), organic_results)
+
+
+class PageCache(SQLiteCache):
+    """
+    Cache of cleaned page text keyed on URL, stored with the ETag and Last-Modified validators.
+    Pages younger than the TTL are served directly. Older pages are kept until max_age so the scraper
+    can revalidate them with a conditional GET and reuse the cached text on a 304 Not Modified.
+    """
+    table = "pages"
+
+    def __init__(self, path="cache/page_cache.sqlite", ttl=60 * 60, max_age=7 * 24 * 60 * 60, max_entries=5000, max_bytes=200 * 1024 * 1024):
+        super().__init__(path, ttl=ttl, max_entries=max_entries, max_bytes=max_bytes, max_age=max_age)
+        self.revalidated = 0
+
+    def record_revalidated(self):
+        with self.lock:
+            self.revalidated += 1
+
+    def stats(self):
+        stats = super().stats()
+        stats["revalidated"] = self.revalidated
+        return stats
+
+
+# Queries about things that change quickly get the short TTL
+TIME_SENSITIVE_RE = re.compile(
+    r"\b(today|tonight|tomorrow|yesterday|now|current(ly)?|latest|recent(ly)?|this (week|month|year)|news|"
+    r"live|price|prices|stock|stocks|weather|forecast|score|scores|election|breaking|20\d\d)\b",
+    re.IGNORECASE
+)
+NUMBER_RE = re.compile(r"\d+(?:[.,]\d+)*")
+
+
+def is_time_sensitive(query):
+    return TIME_SENSITIVE_RE.search(query) is not None
+
+
+def word_edits(words, other):
+    # Words inserted or deleted to turn one word sequence into the other (a substitution counts as two)
+    previous = [0] * (len(other) + 1)
+    for word in words:
+        current = [0]
+        for j, other_word in enumerate(other):
+            current.append(previous[j] + 1 if word == other_word else max(previous[j + 1], current[j]))
+        previous = current
+    return len(words) + len(other) - 2 * previous[-1]
+
+
+class AnswerCache(SQLiteCache):
+    """
+    Cache of final answers (response and sources) keyed on the normalized query, that also matches
+    near-duplicate rewordings. Each query's MinHash signature is split into LSH bands stored in a side
+    table, so a lookup only compares against queries sharing a band. The LSH only finds candidates with
+    an estimated similarity of at least min_similarity; a candidate then matches only when it mentions
+    the same numbers (so "GDP in 2020" never answers "GDP in 2021") and the same negations, and its content
+    words differ by at most one inserted or deleted word per words_per_edit words. Short queries therefore
+    need the same content words in the same order, so "north america" never answers "south america".
+    Answers expire after ttl, or short_ttl for time-sensitive queries.
+    """
+    table = "answers"
+
+    def __init__(self, path="cache/answer_cache.sqlite", ttl=7 * 24 * 60 * 60, short_ttl=60 * 60, min_similarity=0.85, words_per_edit=8, max_entries=10000, max_bytes=None, minhash=None):
+        super().__init__(path, ttl=None, max_entries=max_entries, max_bytes=max_bytes, max_age=max(ttl, short_ttl))
+        self.answer_ttl = ttl
+        self.short_ttl = short_ttl
+        self.min_similarity = min_similarity
+        self.words_per_edit = words_per_edit
+        self.minhash = minhash or MinHash()
+        self.near_hits = 0
+
+        with self.lock, self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS answer_bands (band TEXT NOT NULL, key TEXT NOT NULL, PRIMARY KEY (band, key))")
+
+    def ttl_for(self, query):
+        return self.short_ttl if is_time_sensitive(query) else self.answer_ttl
+
+    def equivalent(self, words, other):
+        # Strict check of a near-duplicate candidate, on the content words of both queries
+        if sorted(w for w in words if w in NEGATION_WORDS) != sorted(w for w in other if w in NEGATION_WORDS):
+            return False
+        allowed = min(len(words), len(other)) // self.words_per_edit
+        return word_edits(words, other) <= allowed
+
+    def lookup(self, query):
+        # Returns (answer, similarity) for the exact or best near-duplicate fresh entry, or None
+        key = normalize_query(query)
+        now = time.time()
+
+        entry = self.get_entry(key)
+        if entry is not None and entry[0]["expires_at"] > now:
+            return entry[0], 1.0
+
+        signature = self.minhash.signature(key)
+        bands = self.minhash.band_keys(signature)
+        with self.lock:
+            candidates = self.conn.execute(
+                f"SELECT DISTINCT a.key, a.value FROM answer_bands b JOIN {self.table} a ON a.key = b.key "
+                f"WHERE b.band IN ({', '.join('?' * len(bands))}) AND a.key != ?",
+                (*bands, key)
+            ).fetchall()
+
+        numbers = set(NUMBER_RE.findall(key))
+        words = content_words(key)
+        best = None
+        for candidate_key, value in candidates:
+            if set(NUMBER_RE.findall(candidate_key)) != numbers:
+                continue
+            answer = json.loads(value)
+            if answer["expires_at"] <= now:
+                continue
+            similarity = MinHash.similarity(signature, answer["signature"])
+            if similarity < self.min_similarity or (best is not None and similarity <= best[1]):
+                continue
+            if self.equivalent(words, content_words(candidate_key)):
+                best = answer, similarity
+
+        if best is not None:
+            with self.lock:
+                self.near_hits += 1
+        return best
+
+    def get(self, query):
+        match = self.lookup(query)
+        self.record(match is not None)
+        return match[0] if match else None
+
+    def set(self, query, response, sources=None):
+        key = normalize_query(query)
+        signature = self.minhash.signature(key)
+        super().set(key, {
+            "query": query,
+            "response": response,
+            "sources": sources or [],
+            "signature": signature,
+            "expires_at": time.time() + self.ttl_for(query)
+        })
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM answer_bands WHERE key = ?", (key,))
+            self.conn.executemany("INSERT OR IGNORE INTO answer_bands (band, key) VALUES (?, ?)",
+                                  [(band, key) for band in self.minhash.band_keys(signature)])
+
+    def evict(self):
+        super().evict()
+        # Bands of evicted answers are dropped with them
+        self.conn.execute(f"DELETE FROM answer_bands WHERE key NOT IN (SELECT key FROM {self.table})")
+
+    def clear(self):
+        super().clear()
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM answer_bands")
+
+    def stats(self):
+        stats = super().stats()
+        stats["near_hits"] = self.near_hits
+        return stats
+
+
+class CompletionCache(SQLiteCache):
+    """
+    On-disk tier of CompletionMemo, keyed on the payload hash.
+    """
+    table = "completions"
+
+    def __init__(self, path="cache/completion_cache.sqlite", ttl=7 * 24 * 60 * 60, max_entries=50000, max_bytes=500 * 1024 * 1024):
+        super().__init__(path, ttl=ttl, max_entries=max_entries, max_bytes=max_bytes)
+
+
+class CompletionMemo:
+    """
+    Memo of deterministic (temperature 0) LLM completions, keyed on a hash of the endpoint and the
+    canonical JSON of the payload, so an identical request is answered without calling the model.
+    The most recent max_entries completions are kept in memory, in front of an optional on-disk
+    CompletionCache (or True for the default one) shared across sessions and processes.
+    Hits and misses are counted per stage, the name of the span the completion was requested from.
+    """
+    def __init__(self, max_entries=1024, disk=None):
+        self.max_entries = max_entries
+        self.disk = CompletionCache() if disk is True else disk
+        self.entries = OrderedDict()
+        self.stage_stats = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(endpoint, payload):
+        canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+        return hashlib.sha256(f"{endpoint}\n{canonical}".encode('utf-8')).hexdigest()
+
+    def get(self, key, stage=None):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.remember(key, value)
+
+        with self.lock:
+            stats = self.stage_stats.setdefault(stage or "unknown", {"hits": 0, "misses": 0})
+            stats["hits" if value is not None else "misses"] += 1
+        return value
+
+    def remember(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def set(self, key, value):
+        self.remember(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.stage_stats.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self):
+        with self.lock:
+            stages = {
+                stage: dict(counts, hit_rate=counts["hits"] / (counts["hits"] + counts["misses"]))
+                for stage, counts in self.stage_stats.items()
+            }
+            return {"entries": len(self.entries), "stages": stages}
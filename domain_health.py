@@ -0,0 +1,171 @@
+import os
+import time
+import sqlite3
+import threading
+from page_selection import get_domain
+
+
+# Statuses that mean the site refuses bots rather than having a transient problem
+BLOCKING_STATUSES = {401, 403, 429, 451}
+
+
+class DomainHealth:
+    """
+    Persistent per-domain scraping health, shared by every session and process using the same file.
+    For each domain it keeps a rolling (exponentially weighted) success rate and latency, the last error
+    and status, and whether the site blocks bots. After failure_threshold consecutive failures, or one
+    blocking status (401/403/429/451), the domain's circuit opens and allow() refuses it until the
+    cooldown has passed. allow() then lets one caller through as a trial, holding the circuit open for
+    trial_timeout while it runs; a recorded success closes the circuit, and each further failure doubles
+    the cooldown up to max_cooldown.
+    The database runs in WAL mode and each update is one IMMEDIATE transaction, so concurrent writers
+    from several processes never lose updates.
+    """
+    def __init__(self, path="cache/domain_health.sqlite", alpha=0.2, failure_threshold=3, cooldown=10 * 60, blocked_cooldown=6 * 60 * 60, max_cooldown=24 * 60 * 60, trial_timeout=60, slow_ms=5000):
+        self.path = path
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.blocked_cooldown = blocked_cooldown
+        self.max_cooldown = max_cooldown
+        self.trial_timeout = trial_timeout
+        self.slow_ms = slow_ms
+        self.short_circuits = 0
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Autocommit mode, with explicit transactions around each read-modify-write
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS domains ("
+                "domain TEXT PRIMARY KEY, requests INTEGER NOT NULL, failures INTEGER NOT NULL, "
+                "consecutive_failures INTEGER NOT NULL, success_rate REAL NOT NULL, latency_ms REAL, "
+                "last_error TEXT, last_status INTEGER, blocked INTEGER NOT NULL, "
+                "open_until REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    def get(self, domain):
+        with self.lock:
+            cursor = self.conn.execute("SELECT * FROM domains WHERE domain = ?", (domain,))
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([column[0] for column in cursor.description], row))
+
+    def allow(self, url):
+        # False while the domain's circuit is open; once its cooldown has passed, True for a single trial caller
+        domain = get_domain(url)
+        now = time.time()
+        entry = self.get(domain)
+        if entry is None or not entry["open_until"]:
+            return True
+
+        allowed = False
+        if entry["open_until"] <= now:
+            with self.lock:
+                self.conn.execute("BEGIN IMMEDIATE")
+                try:
+                    row = self.conn.execute("SELECT open_until FROM domains WHERE domain = ?", (domain,)).fetchone()
+                    open_until = row[0] if row else 0.0
+                    if open_until and open_until <= now:
+                        # Half-open: this caller makes the trial request, and everyone else is refused until
+                        # its result is recorded or trial_timeout passes
+                        self.conn.execute("UPDATE domains SET open_until = ? WHERE domain = ?", (now + self.trial_timeout, domain))
+                    allowed = open_until <= now
+                    self.conn.execute("COMMIT")
+                except Exception:
+                    self.conn.execute("ROLLBACK")
+                    raise
+
+        if not allowed:
+            with self.lock:
+                self.short_circuits += 1
+        return allowed
+
+    def score(self, url):
+        """
+        Health of the url's domain from 0 to 1: 0 while its circuit is open, otherwise its rolling success
+        rate, reduced for domains slower than slow_ms. Unknown domains score 1.
+        """
+        entry = self.get(get_domain(url))
+        if entry is None:
+            return 1.0
+        if entry["open_until"] > time.time():
+            return 0.0
+        score = entry["success_rate"]
+        if entry["latency_ms"] and entry["latency_ms"] > self.slow_ms:
+            score *= self.slow_ms / entry["latency_ms"]
+        return score
+
+    def record(self, url, success, latency_ms=None, error=None, status=None):
+        domain = get_domain(url)
+        now = time.time()
+        blocked = status in BLOCKING_STATUSES
+
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(
+                    "SELECT requests, failures, consecutive_failures, success_rate, latency_ms FROM domains WHERE domain = ?", (domain,)
+                ).fetchone()
+                requests, failures, consecutive_failures, success_rate, average_latency = row or (0, 0, 0, 1.0, None)
+
+                requests += 1
+                success_rate += self.alpha * ((1.0 if success else 0.0) - success_rate)
+                if latency_ms is not None:
+                    average_latency = latency_ms if average_latency is None else average_latency + self.alpha * (latency_ms - average_latency)
+
+                open_until = 0.0
+                if success:
+                    consecutive_failures = 0
+                else:
+                    failures += 1
+                    consecutive_failures += 1
+                    if blocked:
+                        open_until = now + self.blocked_cooldown
+                    elif consecutive_failures >= self.failure_threshold:
+                        backoff = self.cooldown * 2 ** (consecutive_failures - self.failure_threshold)
+                        open_until = now + min(backoff, self.max_cooldown)
+
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO domains (domain, requests, failures, consecutive_failures, success_rate, "
+                    "latency_ms, last_error, last_status, blocked, open_until, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (domain, requests, failures, consecutive_failures, success_rate, average_latency,
+                     None if success else error, status, int(blocked), open_until, now)
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def record_success(self, url, latency_ms=None, status=None):
+        self.record(url, True, latency_ms=latency_ms, status=status)
+
+    def record_failure(self, url, error, latency_ms=None, status=None):
+        self.record(url, False, latency_ms=latency_ms, error=error, status=status)
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM domains")
+
+    def stats(self):
+        now = time.time()
+        with self.lock:
+            domains, open_circuits, blocked = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(open_until > ?), 0), COALESCE(SUM(blocked), 0) FROM domains", (now,)
+            ).fetchone()
+        return {
+            "domains": domains,
+            "open_circuits": open_circuits,
+            "blocked": blocked,
+            "short_circuits": self.short_circuits
+        }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
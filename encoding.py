@@ -0,0 +1,136 @@
+import re
+import codecs
+import threading
+from collections import Counter
+
+try:
+    import cchardet
+except ImportError:  # optional C detector
+    cchardet = None
+
+try:
+    import charset_normalizer
+except ImportError:
+    charset_normalizer = None
+
+import chardet
+
+
+BOMS = (
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+META_CHARSET_RE = re.compile(rb'<meta[^>]+?charset\s*=\s*["\']?\s*([a-zA-Z0-9_\-:.]+)', re.IGNORECASE)
+
+# Browsers decode these labels as windows-1252, which is a superset of them
+WINDOWS_1252_ALIASES = {'latin-1', 'iso8859-1', 'ascii'}
+
+DETECTORS = ('auto', 'cchardet', 'charset_normalizer', 'chardet')
+
+
+def normalize_encoding(label):
+    # Python codec name for an encoding label, or None if Python does not know it
+    if not label:
+        return None
+    if isinstance(label, bytes):
+        label = label.decode('ascii', errors='ignore')
+    try:
+        name = codecs.lookup(label.strip()).name
+    except LookupError:
+        return None
+    return 'cp1252' if name in WINDOWS_1252_ALIASES else name
+
+
+def charset_from_content_type(content_type):
+    for param in (content_type or '').split(';')[1:]:
+        key, _, value = param.partition('=')
+        if key.strip().lower() == 'charset':
+            return normalize_encoding(value.strip().strip('"\''))
+    return None
+
+
+class EncodingResolver:
+    """
+    Works out how to decode a page without scanning the whole body.
+    The encoding is taken from, in order: a byte order mark, the Content-Type charset, a <meta charset>
+    in the first meta_bytes of the page, and finally a detector run on at most sample_bytes of the body.
+    Counts of how often each path was taken are available from stats().
+    """
+    def __init__(self, sample_bytes=64 * 1024, meta_bytes=8192, detector='auto', min_confidence=0.5):
+        if detector not in DETECTORS:
+            raise ValueError(f"Unknown detector '{detector}', expected one of {DETECTORS}")
+        self.sample_bytes = sample_bytes
+        self.meta_bytes = meta_bytes
+        self.detector = detector
+        self.min_confidence = min_confidence
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def record(self, path):
+        with self.lock:
+            self.counts[path] += 1
+
+    def detect(self, sample):
+        detector = self.detector
+        if detector == 'auto':
+            if cchardet is not None:
+                detector = 'cchardet'
+            elif charset_normalizer is not None:
+                detector = 'charset_normalizer'
+            else:
+                detector = 'chardet'
+
+        if detector == 'charset_normalizer':
+            match = charset_normalizer.from_bytes(sample).best()
+            return match.encoding if match is not None else None
+
+        module = cchardet if detector == 'cchardet' else chardet
+        detected = module.detect(sample)
+        if detected['encoding'] and (detected['confidence'] or 0) > self.min_confidence:
+            return detected['encoding']
+        return None
+
+    def resolve(self, content_type, head):
+        """
+        Returns the encoding for a page given its Content-Type header and the first bytes of its body.
+        """
+        for bom, encoding in BOMS:
+            if head.startswith(bom):
+                self.record('bom')
+                return encoding
+
+        encoding = charset_from_content_type(content_type)
+        if encoding:
+            self.record('header')
+            return encoding
+
+        match = META_CHARSET_RE.search(head[:self.meta_bytes])
+        encoding = normalize_encoding(match.group(1)) if match else None
+        if encoding:
+            self.record('meta')
+            return encoding
+
+        sample = head[:self.sample_bytes]
+        if sample.isascii():
+            self.record('ascii')
+            return 'utf-8'
+
+        encoding = normalize_encoding(self.detect(sample))
+        if encoding:
+            self.record('detected')
+            return encoding
+
+        self.record('default')
+        return 'utf-8'
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts)
+
+
+# Shared by every WebSearcher that is not given its own resolver, so the stats cover the whole process
+default_resolver = EncodingResolver()
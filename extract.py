@@ -0,0 +1,138 @@
+import codecs
+from html.parser import HTMLParser
+from bs4 import BeautifulSoup
+
+try:
+    import lxml.html
+    from lxml import etree
+except ImportError:  # lxml is optional, the fast and bs4 engines do not need it
+    lxml = None
+
+
+# Elements whose text is boilerplate (or not text at all) and never useful as research content
+# (not 'form' or 'header': ASP.NET-style pages wrap the whole body in a <form>, and article headers hold titles)
+SKIP_TAGS = {'script', 'style', 'noscript', 'template', 'svg', 'nav', 'footer', 'aside', 'iframe'}
+
+EXTRACTORS = ('fast', 'lxml', 'bs4')
+
+
+class TextExtractor(HTMLParser):
+    """
+    Streaming HTML-to-text extractor.
+    Collects words from the document as it is fed, skips the contents of boilerplate elements and stops
+    parsing as soon as max_words words have been collected, so the rest of a large page is never tokenized.
+    """
+    def __init__(self, max_words=4000):
+        super().__init__(convert_charrefs=True)
+        self.max_words = max_words
+        self.words = []
+        self.skip_depth = 0
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self.skip_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS and self.skip_depth:
+            self.skip_depth -= 1
+
+    def handle_data(self, data):
+        if self.skip_depth or self.done:
+            return
+        self.words.extend(data.split())
+        if len(self.words) >= self.max_words:
+            self.done = True
+
+    def feed(self, data):
+        # HTMLParser.feed tokenizes everything it is given, so feed in slices and stop once the budget is met
+        step = 16384
+        for start in range(0, len(data), step):
+            if self.done:
+                return
+            super().feed(data[start:start + step])
+
+    def text(self):
+        return ' '.join(self.words[:self.max_words])
+
+
+def extract_fast(content, max_words=4000):
+    extractor = TextExtractor(max_words=max_words)
+    extractor.feed(content)
+    extractor.close()
+    return extractor.text()
+
+
+def extract_stream(chunks, encoding, max_words=4000):
+    """
+    Decodes byte chunks incrementally and feeds them to the streaming extractor,
+    so no more of the body is downloaded or parsed than is needed to reach max_words.
+    Like extract_text, falls back to BeautifulSoup on the whole (already downloaded) body if the
+    streaming extractor finds no text.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    extractor = TextExtractor(max_words=max_words)
+    body = []
+    for chunk in chunks:
+        body.append(chunk)
+        extractor.feed(decoder.decode(chunk))
+        if extractor.done:
+            break
+    else:
+        extractor.feed(decoder.decode(b'', final=True))
+    extractor.close()
+
+    text = extractor.text()
+    if text:
+        return text
+    return extract_bs4(b''.join(body).decode(encoding, errors='replace'), max_words=max_words)
+
+
+def extract_lxml(content, max_words=4000):
+    if lxml is None:
+        raise ImportError("lxml is not installed")
+
+    # The content is already decoded, so parse it as UTF-8 regardless of any <meta charset> in the page
+    parser = lxml.html.HTMLParser(encoding='utf-8')
+    tree = lxml.html.document_fromstring(content.encode('utf-8'), parser=parser)
+    etree.strip_elements(tree, *SKIP_TAGS, etree.Comment, with_tail=False)
+
+    words = []
+    for text in tree.itertext():
+        words.extend(text.split())
+        if len(words) >= max_words:
+            break
+    return ' '.join(words[:max_words])
+
+
+def extract_bs4(content, max_words=4000):
+    # Parsing the page content using BeautifulSoup
+    soup = BeautifulSoup(content, 'html.parser')
+    text = soup.get_text(separator='\n')
+    # Cleaning up the text: removing excess whitespace
+    clean_text = '\n'.join([line.strip() for line in text.splitlines() if line.strip()])
+    split_text = clean_text.split()
+    return ' '.join(split_text[:max_words])
+
+
+def extract_text(content, engine='fast', max_words=4000):
+    """
+    Converts an HTML document to plain text, keeping at most max_words words.
+    engine is one of 'fast' (streaming, stops at the word budget), 'lxml' or 'bs4'. If the selected
+    engine is unavailable, fails, or finds no text, the BeautifulSoup extraction is used instead.
+    """
+    if engine not in EXTRACTORS:
+        raise ValueError(f"Unknown extractor '{engine}', expected one of {EXTRACTORS}")
+
+    if engine != 'bs4':
+        try:
+            if engine == 'fast':
+                text = extract_fast(content, max_words=max_words)
+            else:
+                text = extract_lxml(content, max_words=max_words)
+            if text:
+                return text
+        except Exception as e:
+            print(f"{engine} extraction failed, falling back to BeautifulSoup: {e}")
+
+    return extract_bs4(content, max_words=max_words)
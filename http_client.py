@@ -0,0 +1,123 @@
+import time
+import itertools
+import tracing
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class HTTPClient:
+    """
+    Shared HTTP client used by the Agent and the WebSearcher for every LLM, Serper and scrape call.
+    A single requests.Session keeps a pool of keep-alive connections per host, so repeated calls to the
+    same model endpoint or to serper.dev reuse the TCP+TLS connection instead of handshaking every time.
+    Every request gets a timeout (unless one is passed explicitly). Failures where the server cannot
+    have done the work (connection errors, and 429/502/503/504 responses) are retried with exponential
+    backoff; read timeouts never are, since a timed-out LLM POST may still be generating (and billed).
+    Scraped pages go through a separate pool with page_retries (none by default), so a dead site costs
+    one timeout rather than several.
+    """
+    def __init__(self, pool_connections=10, pool_maxsize=20, timeout=120, retries=3, backoff_factor=0.5,
+                 status_forcelist=(429, 502, 503, 504), page_retries=0):
+        self.timeout = timeout
+        self.session = self.make_session(pool_connections, pool_maxsize, retries, backoff_factor, status_forcelist)
+        self.page_session = self.make_session(pool_connections, pool_maxsize, page_retries, backoff_factor, status_forcelist)
+
+    @staticmethod
+    def make_session(pool_connections, pool_maxsize, retries, backoff_factor, status_forcelist):
+        session = requests.Session()
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=False,  # re-raise read timeouts as ReadTimeout instead of wrapping them in a retry error
+            status=retries,
+            other=0,
+            backoff_factor=backoff_factor,
+            status_forcelist=status_forcelist,
+            allowed_methods=None,  # LLM and Serper calls are POSTs, retry them too (connect errors and the statuses above only)
+            raise_on_status=False,
+            respect_retry_after_header=True,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def request(self, method, url, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.timeout
+        return self.session.request(method, url, timeout=timeout, **kwargs)
+
+    def get(self, url, timeout=None, **kwargs):
+        return self.request("GET", url, timeout=timeout, **kwargs)
+
+    def get_page(self, url, timeout=None, **kwargs):
+        # GET of a scraped website, with the page retry policy
+        return self.page_session.get(url, timeout=self.timeout if timeout is None else timeout, **kwargs)
+
+    def post(self, url, timeout=None, **kwargs):
+        return self.request("POST", url, timeout=timeout, **kwargs)
+
+    def close(self):
+        self.session.close()
+        self.page_session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+TEXT_CONTENT_TYPES = ('text/html', 'application/xhtml+xml', 'text/plain', 'text/xml', 'application/xml')
+
+
+def is_text_content_type(content_type):
+    # Pages without a Content-Type are given the benefit of the doubt
+    if not content_type:
+        return True
+    return content_type.split(';')[0].strip().lower() in TEXT_CONTENT_TYPES
+
+
+def iter_body(response, max_bytes, chunk_size=16384):
+    # Yields the (decompressed) body of a streamed response, stopping once max_bytes have been read
+    read = 0
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        if not chunk:
+            continue
+        remaining = max_bytes - read
+        if len(chunk) >= remaining:
+            yield chunk[:remaining]
+            return
+        read += len(chunk)
+        yield chunk
+
+
+def read_head(chunks, size):
+    # Reads at least size bytes (or the whole body if shorter) and returns them with an iterator over the rest
+    chunks = iter(chunks)
+    head = []
+    read = 0
+    for chunk in chunks:
+        head.append(chunk)
+        read += len(chunk)
+        if read >= size:
+            break
+    return b''.join(head), chunks
+
+
+def chain_head(head, rest):
+    return itertools.chain([head], rest)
+
+
+def timed_chunks(chunks):
+    # Records the time spent waiting on the network and the bytes received on the current span
+    chunks = iter(chunks)
+    while True:
+        start = time.perf_counter()
+        chunk = next(chunks, None)
+        tracing.add('download_ms', (time.perf_counter() - start) * 1000)
+        if chunk is None:
+            return
+        tracing.add('bytes', len(chunk))
+        yield chunk
@@ -0,0 +1,371 @@
+import ast
+import json
+import time
+import threading
+import tracing
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+from streaming import iter_tokens
+
+
+# Models served without a system role: the system prompt is folded into the user message instead
+EXCEPTION_MODELS = ['microsoft/Phi-3-medium-128k-instruct',
+                    'microsoft/Phi-3-mini-128k-instruct',
+                    'microsoft/Phi-3-medium-4k-instruct',
+                    'microsoft/Phi-3-mini-4k-instruct',
+                    ]
+
+
+def parse_json(content):
+    try:
+        return json.loads(content)
+    except json.JSONDecodeError:
+        return ast.literal_eval(content)
+
+
+class LLMBackend(ABC):
+    """
+    Builds payloads for one model on one server type and parses its responses.
+    The parts of the payload that never change (model, temperature, stop, headers) are computed once
+    in the constructor; each call only adds the prompts. Subclasses implement the server specifics.
+    With a CompletionMemo, temperature 0 completions are looked up by payload before calling the server.
+    Backends with supports_batch send complete_batch as a single request the server runs as one batch.
+    """
+    server = None
+    supports_batch = False
+
+    def __init__(self, model, model_endpoint, http_client, headers=None, stop=None, timeout=None, memo=None):
+        self.model = model
+        self.memo = memo
+        self.model_endpoint = model_endpoint
+        self.http_client = http_client
+        self.headers = headers or {"Content-Type": "application/json"}
+        self.stop = stop
+        self.timeout = timeout
+        self.base_payload = self.build_base_payload()
+
+    @abstractmethod
+    def build_base_payload(self):
+        """
+        The static part of every payload, computed once per backend.
+        """
+
+    @abstractmethod
+    def build_payload(self, system_prompt, prompt, json_schema=None, stream=False):
+        """
+        The full payload for one call.
+        """
+
+    @abstractmethod
+    def parse_response(self, response_dict):
+        """
+        The generated text in a (non-streamed) response.
+        """
+
+    def post(self, payload, stream=False, endpoint=None):
+        data = json.dumps(payload)
+        tracing.set_attributes(request_bytes=len(data))
+        response = self.http_client.post(endpoint or self.model_endpoint, headers=self.headers, data=data, stream=stream, timeout=self.timeout)
+        response.raise_for_status()
+        return response
+
+    def memo_key(self, payload):
+        # Only deterministic completions can be reused
+        if self.memo is None or payload.get("temperature") != 0:
+            return None
+        return self.memo.key(self.model_endpoint, payload)
+
+    def complete(self, system_prompt, prompt, json_schema=None, parse=None):
+        """
+        Returns the generated text for a system prompt and user prompt, or parse(text) if parse is given.
+        A completion is only memoized once parse accepts it, so a reply that fails to parse is never replayed.
+        """
+        stage = tracing.current_name()
+        with tracing.span("llm", server=self.server, model=self.model):
+            payload = self.build_payload(system_prompt, prompt, json_schema=json_schema)
+            key = self.memo_key(payload)
+            if key is not None:
+                content = self.memo.get(key, stage=stage)
+                tracing.set_attributes(memo_hit=content is not None)
+                if content is not None:
+                    return parse(content) if parse else content
+
+            response = self.post(payload)
+            response_dict = response.json()
+            tracing.set_attributes(response_bytes=len(response.content))
+            tracing.record_usage(response_dict)
+            content = self.parse_response(response_dict)
+            result = parse(content) if parse else content
+
+            if key is not None:
+                self.memo.set(key, content)
+            return result
+
+    def complete_json(self, system_prompt, prompt, json_schema=None):
+        return self.complete(system_prompt, prompt, json_schema=json_schema, parse=parse_json)
+
+    def complete_batch(self, requests, json_schema=None, parse=None, max_tokens=None):
+        """
+        Returns the results of several independent (system_prompt, prompt) requests, in order, with a failed
+        request returned as its exception rather than failing the others. Servers without a batch API get
+        one call per request.
+        """
+        results = []
+        for system_prompt, prompt in requests:
+            try:
+                results.append(self.complete(system_prompt, prompt, json_schema=json_schema, parse=parse))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def stream(self, system_prompt, prompt):
+        """
+        Yields the generated text token by token.
+        """
+        payload = self.build_payload(system_prompt, prompt, stream=True)
+        # The stream flag is left out of the key so streamed and non-streamed calls share completions
+        memo_payload = dict(payload, stream=False)
+        memo_payload.pop("stream_options", None)
+        key = self.memo_key(memo_payload)
+        if key is not None:
+            content = self.memo.get(key, stage=tracing.current_name())
+            tracing.set_attributes(memo_hit=content is not None)
+            if content is not None:
+                yield content
+                return
+
+        start = time.perf_counter()
+        tokens = []
+        with self.post(payload, stream=True) as response:
+            for token in iter_tokens(response, self.server):
+                if not tokens:
+                    tracing.set_attributes(first_token_ms=round((time.perf_counter() - start) * 1000, 3))
+                tokens.append(token)
+                yield token
+        tracing.set_attributes(streamed_chunks=len(tokens))
+
+        if key is not None:
+            self.memo.set(key, ''.join(tokens))
+
+
+class OllamaBackend(LLMBackend):
+    server = 'ollama'
+
+    def __init__(self, model, model_endpoint, http_client, headers=None, stop=None, timeout=None, memo=None, keep_alive=None):
+        # How long Ollama keeps the model, and with it the cached prompt prefix, loaded after a call (e.g. "30m")
+        self.keep_alive = keep_alive
+        super().__init__(model, model_endpoint, http_client, headers=headers, stop=stop, timeout=timeout, memo=memo)
+
+    def build_base_payload(self):
+        payload = {
+            "model": self.model,
+            "stream": False,
+            "temperature": 0,
+        }
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        return payload
+
+    def build_payload(self, system_prompt, prompt, json_schema=None, stream=False):
+        payload = dict(self.base_payload, prompt=prompt, system=system_prompt, stream=stream)
+        if json_schema is not None:
+            payload["format"] = "json"
+        return payload
+
+    def parse_response(self, response_dict):
+        return response_dict['response']
+
+
+class OpenAICompatibleBackend(LLMBackend):
+    """
+    Chat completions API shared by OpenAI and vLLM.
+    """
+    server = 'openai'
+    # Whether the server understands 'stop' and vLLM's 'guided_json'
+    vllm_extensions = False
+
+    def __init__(self, model, model_endpoint, http_client, headers=None, stop=None, timeout=None, memo=None):
+        self.user_only = model.split('/')[0] == 'mistralai' or model in EXCEPTION_MODELS
+        super().__init__(model, model_endpoint, http_client, headers=headers, stop=stop, timeout=timeout, memo=memo)
+
+    def build_base_payload(self):
+        payload = {
+            "model": self.model,
+            "temperature": 0,
+        }
+        if self.vllm_extensions:
+            payload["stop"] = None if self.user_only else self.stop
+        return payload
+
+    def build_messages(self, system_prompt, prompt):
+        if self.user_only:
+            return [{"role": "user", "content": f"system_prompt: {system_prompt}\n\n{prompt}"}]
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ]
+
+    def build_payload(self, system_prompt, prompt, json_schema=None, stream=False):
+        payload = dict(self.base_payload, messages=self.build_messages(system_prompt, prompt), stream=stream)
+        if json_schema is not None:
+            payload["response_format"] = {"type": "json_object"}
+            if self.vllm_extensions:
+                payload["guided_json"] = json_schema
+        if stream:
+            # Ask for token usage in the last chunk of the stream
+            payload["stream_options"] = {"include_usage": True}
+        return payload
+
+    def parse_response(self, response_dict):
+        return response_dict['choices'][0]['message']['content']
+
+
+class OpenAIBackend(OpenAICompatibleBackend):
+    server = 'openai'
+
+    def __init__(self, model, model_endpoint, http_client, api_key=None, stop=None, timeout=None, memo=None):
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {api_key}'
+        }
+        super().__init__(model, model_endpoint, http_client, headers=headers, stop=stop, timeout=timeout, memo=memo)
+
+
+class RunPodBackend(OpenAICompatibleBackend):
+    # vLLM's OpenAI-compatible server, e.g. hosted on RunPod
+    server = 'runpod'
+    vllm_extensions = True
+    supports_batch = True
+
+    def __init__(self, model, model_endpoint, http_client, headers=None, stop=None, timeout=None, memo=None):
+        super().__init__(model, model_endpoint, http_client, headers=headers, stop=stop, timeout=timeout, memo=memo)
+        # .../v1/chat/completions -> .../v1/completions and .../tokenize
+        api_root = model_endpoint.rstrip('/').rsplit('/chat/completions', 1)[0]
+        self.completions_endpoint = api_root + '/completions'
+        self.tokenize_endpoint = api_root.rsplit('/v1', 1)[0] + '/tokenize'
+
+    def tokenize(self, system_prompt, prompt):
+        # The conversation rendered with the model's chat template by vLLM, as token ids
+        payload = {"model": self.model, "messages": self.build_messages(system_prompt, prompt), "add_generation_prompt": True}
+        response = self.http_client.post(self.tokenize_endpoint, headers=self.headers, data=json.dumps(payload), timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()["tokens"]
+
+    def complete_batch(self, requests, json_schema=None, parse=None, max_tokens=None):
+        """
+        Sends the requests as one /v1/completions call with a list of prompts, which vLLM schedules as a single
+        batch. Each conversation is first rendered with the model's chat template by vLLM's /tokenize endpoint,
+        so the batch runs the same prompts as the chat API would. Memoized requests are answered without
+        being sent, and a completion is only memoized once parse accepts it.
+        """
+        stage = tracing.current_name()
+        results = [None] * len(requests)
+        keys = [None] * len(requests)
+        pending = []
+        with tracing.span("llm", server=self.server, model=self.model, batch_size=len(requests)):
+            for i, (system_prompt, prompt) in enumerate(requests):
+                # Keyed on the chat payload, so batched and single calls share memoized completions
+                keys[i] = self.memo_key(self.build_payload(system_prompt, prompt, json_schema=json_schema))
+                content = self.memo.get(keys[i], stage=stage) if keys[i] is not None else None
+                if content is None:
+                    pending.append(i)
+                    continue
+                try:
+                    results[i] = parse(content) if parse else content
+                except Exception as e:
+                    results[i] = e
+            tracing.set_attributes(memo_hits=len(requests) - len(pending))
+            if not pending:
+                return results
+
+            try:
+                payload = dict(self.base_payload, prompt=[self.tokenize(*requests[i]) for i in pending], max_tokens=max_tokens or 1000)
+                if json_schema is not None:
+                    payload["guided_json"] = json_schema
+                response = self.post(payload, endpoint=self.completions_endpoint)
+                response_dict = response.json()
+                tracing.set_attributes(response_bytes=len(response.content))
+                tracing.record_usage(response_dict)
+                choices = sorted(response_dict['choices'], key=lambda choice: choice['index'])
+            except Exception as e:
+                for i in pending:
+                    results[i] = e
+                return results
+
+            for i, choice in zip(pending, choices):
+                try:
+                    results[i] = parse(choice['text']) if parse else choice['text']
+                except Exception as e:
+                    results[i] = e
+                    continue
+                if keys[i] is not None:
+                    self.memo.set(keys[i], choice['text'])
+        return results
+
+
+class RequestBatcher:
+    """
+    Collects requests for the same kind of call (same json_schema and parse) made at about the same time
+    from different threads, e.g. the QA checks of concurrent queries, and sends them to the backend as one
+    complete_batch. The first request of a batch waits up to max_wait for others to join it (or until
+    max_batch are waiting), then its thread sends the batch while the other callers block on their result.
+    """
+    def __init__(self, backend, json_schema=None, parse=None, max_batch=8, max_wait=0.02, max_tokens=None):
+        self.backend = backend
+        self.json_schema = json_schema
+        self.parse = parse
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_tokens = max_tokens
+        self.pending = []
+        self.condition = threading.Condition()
+
+    def submit(self, system_prompt, prompt):
+        # Returns the request's result, or raises its exception
+        future = Future()
+        with self.condition:
+            self.pending.append(((system_prompt, prompt), future))
+            leader = len(self.pending) == 1
+            self.condition.notify_all()
+        if leader:
+            self.drain()
+        return future.result()
+
+    def drain(self):
+        with self.condition:
+            self.condition.wait_for(lambda: len(self.pending) >= self.max_batch, timeout=self.max_wait)
+        more = True
+        while more:
+            with self.condition:
+                batch, self.pending = self.pending[:self.max_batch], self.pending[self.max_batch:]
+                # Requests left over beyond max_batch are sent next by this thread; once none are left,
+                # the next request to arrive starts a batch of its own
+                more = bool(self.pending)
+            if not batch:
+                return
+            try:
+                results = self.backend.complete_batch([request for request, _ in batch], json_schema=self.json_schema, parse=self.parse, max_tokens=self.max_tokens)
+            except Exception as e:
+                results = [e] * len(batch)
+            for (_, future), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+
+BACKENDS = {
+    'ollama': OllamaBackend,
+    'runpod': RunPodBackend,
+    'openai': OpenAIBackend,
+}
+
+
+def get_backend(server, model, model_endpoint, http_client, api_key=None, stop=None, timeout=None, memo=None, keep_alive=None):
+    if server not in BACKENDS:
+        raise ValueError(f"Unknown server '{server}', expected one of {list(BACKENDS)}")
+    if server == 'openai':
+        return OpenAIBackend(model, model_endpoint, http_client, api_key=api_key, stop=stop, timeout=timeout, memo=memo)
+    if server == 'ollama':
+        return OllamaBackend(model, model_endpoint, http_client, stop=stop, timeout=timeout, memo=memo, keep_alive=keep_alive)
+    return BACKENDS[server](model, model_endpoint, http_client, stop=stop, timeout=timeout, memo=memo)
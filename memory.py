@@ -0,0 +1,161 @@
+import os
+import re
+import json
+import uuid
+import threading
+from collections import OrderedDict
+from tokens import count_tokens, truncate_tokens
+
+
+class MemoryStore:
+    """
+    Feedback memory for a single agent session.
+    Entries are kept in process and each new one is appended as a line to the session's own JSONL log,
+    so saving never rewrites the history and concurrent sessions never touch the same file.
+    A session can be resumed from its log with MemoryStore.load.
+    """
+    def __init__(self, session_id=None, directory="memory", persist=True):
+        self.session_id = session_id or uuid.uuid4().hex
+        self.path = os.path.join(directory, f"{self.session_id}.jsonl") if persist else None
+        self.entries = []
+        self.lock = threading.Lock()
+        self.feedback_json = None
+
+        if self.path:
+            os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def load(cls, session_id, directory="memory"):
+        memory = cls(session_id=session_id, directory=directory)
+        if os.path.exists(memory.path):
+            with open(memory.path, "r") as log_file:
+                memory.entries = [json.loads(line) for line in log_file if line.strip()]
+        return memory
+
+    def save_feedback(self, response):
+        # Create a dictionary with the response
+        feedback_entry = {"feedback": response}
+
+        with self.lock:
+            self.entries.append(feedback_entry)
+            self.feedback_json = None
+
+            if self.path:
+                with open(self.path, "a") as log_file:
+                    log_file.write(json.dumps(feedback_entry) + "\n")
+
+    def read_feedback(self):
+        # The pretty-printed history is only rebuilt after a new entry is saved
+        with self.lock:
+            if self.feedback_json is None:
+                self.feedback_json = json.dumps(self.entries, indent=4)
+            return self.feedback_json
+
+    def build_context(self, feedback_context):
+        # Token-budgeted feedback, returned with its token count
+        with self.lock:
+            entries = list(self.entries)
+        return feedback_context.build(entries)
+
+    def clear(self):
+        with self.lock:
+            self.entries = []
+            self.feedback_json = None
+            if self.path and os.path.exists(self.path):
+                os.remove(self.path)
+
+
+def compact(text, max_sentences=2):
+    # Extractive summary of an entry: its first few sentences on one line
+    sentences = re.split(r'(?<=[.!?])\s+', ' '.join(str(text).split()))
+    return ' '.join(sentences[:max_sentences])
+
+
+class FeedbackContext:
+    """
+    Keeps the feedback injected into prompts within a token budget.
+    Repeated entries are dropped, the most recent entries are kept verbatim and older ones are compacted
+    into a rolling summary of their first sentences, oldest dropped first once the budget is reached.
+    Summaries are computed once per entry, so building the context each iteration stays cheap; the
+    context is shared by every query an agent runs, so only the max_summaries most recently used are kept.
+    """
+    def __init__(self, max_tokens=1500, recent_entries=2, summary_sentences=2, max_summaries=1024):
+        self.max_tokens = max_tokens
+        self.recent_entries = recent_entries
+        self.summary_sentences = summary_sentences
+        self.max_summaries = max_summaries
+        self.summaries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def summarize(self, text):
+        with self.lock:
+            summary = self.summaries.get(text)
+            if summary is not None:
+                self.summaries.move_to_end(text)
+                return summary
+
+        summary = compact(text, max_sentences=self.summary_sentences)
+        with self.lock:
+            self.summaries[text] = summary
+            self.summaries.move_to_end(text)
+            while len(self.summaries) > self.max_summaries:
+                self.summaries.popitem(last=False)
+        return summary
+
+    def build(self, entries):
+        """
+        Returns the feedback text for the prompts and the number of tokens it uses.
+        """
+        # Dedupe, keeping the latest occurrence of each entry
+        seen = set()
+        unique = []
+        for entry in reversed(entries):
+            text = str(entry.get("feedback", ""))
+            key = ' '.join(text.lower().split())
+            if key and key not in seen:
+                seen.add(key)
+                unique.append(text)
+        unique.reverse()
+
+        recent = unique[-self.recent_entries:] if self.recent_entries else []
+        older = unique[:len(unique) - len(recent)]
+
+        # Recent entries share the budget verbatim, truncated only if they alone exceed it
+        budget = self.max_tokens
+        recent_context = []
+        for text in reversed(recent):
+            share = max(budget // (len(recent) - len(recent_context)), 0)
+            text = truncate_tokens(text, share)
+            recent_context.insert(0, {"feedback": text})
+            budget -= count_tokens(text)
+
+        # Older entries are summarized, newest first, until the remaining budget is spent
+        summary = []
+        for text in reversed(older):
+            line = f"- {self.summarize(text)}"
+            cost = count_tokens(line)
+            if cost > budget:
+                break
+            summary.insert(0, line)
+            budget -= cost
+
+        while True:
+            context = ([{"summary": '\n'.join(summary)}] if summary else []) + recent_context
+            feedback = json.dumps(context, indent=4)
+            tokens = count_tokens(feedback)
+            # The JSON layout and escaping add tokens on top of the entries themselves
+            if tokens <= self.max_tokens:
+                return feedback, tokens
+            if summary:
+                summary.pop(0)
+            elif recent_context:
+                # Without a summary left to drop, trim the oldest recent entry by the excess,
+                # dropping it once it is empty
+                text = recent_context[0]["feedback"]
+                trimmed = truncate_tokens(text, max(count_tokens(text) - (tokens - self.max_tokens), 0))
+                if trimmed and trimmed != text:
+                    recent_context[0]["feedback"] = trimmed
+                else:
+                    recent_context.pop(0)
+            else:
+                return feedback, tokens
@@ -0,0 +1,80 @@
+import re
+import random
+import hashlib
+
+
+# Mersenne prime larger than any 32-bit shingle hash
+PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+WORD_RE = re.compile(r"\w+")
+
+# Filler words that rewordings add or drop without changing the question; question words are kept,
+# since "when was X born" and "where was X born" are different questions
+FILLER_WORDS = {
+    'a', 'an', 'the', 'is', 'are', 'was', 'were', 'be', 'been', 'do', 'does', 'did', 'of', 'to', 'so',
+    'and', 'it', 'its', 'please', 'tell', 'me', 'can', 'you', 'could', 'would', 'i', 'want', 'know',
+    'really', 'actually', 'exactly', 'just', 'explain',
+}
+# Negations turn a question around while barely changing its words, so they are never filler
+NEGATION_WORDS = {'not', 'no', 'never', 'without', 'none', 'nor', 'neither'}
+CONTRACTIONS = [
+    (re.compile(r"\bcan['’]?t\b|\bcannot\b"), "can not"),
+    (re.compile(r"\bwon['’]t\b"), "will not"),
+    (re.compile(r"n['’]t\b"), " not"),
+]
+
+
+def content_words(text):
+    # Content words of the query in order, with negations spelled out and plural 's' stripped,
+    # so small rewordings map to the same words
+    text = text.lower()
+    for pattern, replacement in CONTRACTIONS:
+        text = pattern.sub(replacement, text)
+    words = []
+    for word in WORD_RE.findall(text):
+        if word in FILLER_WORDS:
+            continue
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        words.append(word)
+    return words
+
+
+def shingles(text):
+    return set(content_words(text)) or {text.lower()}
+
+
+def hash_shingle(shingle):
+    return int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=4).digest(), 'big')
+
+
+class MinHash:
+    """
+    MinHash signatures estimating the Jaccard similarity of queries' content word sets, and the LSH band
+    keys used to find similar signatures without comparing against every stored one. With b bands of r rows,
+    two texts of similarity s share at least one band with probability 1 - (1 - s^r)^b.
+    The permutations are seeded, so signatures are stable across processes and runs.
+    """
+    def __init__(self, num_perm=64, bands=16, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        rng = random.Random(seed)
+        self.permutations = [(rng.randrange(1, PRIME), rng.randrange(0, PRIME)) for _ in range(num_perm)]
+
+    def signature(self, text):
+        hashes = [hash_shingle(shingle) for shingle in shingles(text)]
+        return [min((a * h + b) % PRIME & MAX_HASH for h in hashes) for a, b in self.permutations]
+
+    def band_keys(self, signature):
+        return [
+            f"{band}:" + hashlib.blake2b(repr(signature[band * self.rows:(band + 1) * self.rows]).encode(), digest_size=8).hexdigest()
+            for band in range(self.bands)
+        ]
+
+    @staticmethod
+    def similarity(signature, other):
+        return sum(a == b for a, b in zip(signature, other)) / len(signature)
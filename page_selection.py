@@ -0,0 +1,123 @@
+import tracing
+from urllib.parse import urlsplit
+from ranking import canonical_url, tokenize
+
+
+# Prior on how useful a domain's pages are as research sources, from 0 (useless or unscrapable) to 1.
+# Subdomains inherit the score of their parent domain; anything unlisted scores DEFAULT_REPUTATION.
+DOMAIN_REPUTATION = {
+    'wikipedia.org': 0.95,
+    'britannica.com': 0.9,
+    'nature.com': 0.9,
+    'arxiv.org': 0.85,
+    'nih.gov': 0.9,
+    'nasa.gov': 0.9,
+    'who.int': 0.9,
+    'reuters.com': 0.85,
+    'apnews.com': 0.85,
+    'bbc.co.uk': 0.8,
+    'bbc.com': 0.8,
+    'theguardian.com': 0.75,
+    'nytimes.com': 0.6,  # often paywalled
+    'stackoverflow.com': 0.8,
+    'github.com': 0.75,
+    'docs.python.org': 0.9,
+    'investopedia.com': 0.75,
+    'medium.com': 0.5,
+    'reddit.com': 0.3,
+    'quora.com': 0.2,
+    'pinterest.com': 0.05,
+    'youtube.com': 0.05,
+    'tiktok.com': 0.05,
+    'instagram.com': 0.05,
+    'facebook.com': 0.05,
+    'twitter.com': 0.05,
+    'x.com': 0.05,
+    'linkedin.com': 0.1,
+}
+# Top-level domains of institutions that are usually reliable
+TLD_REPUTATION = {'gov': 0.85, 'edu': 0.8, 'int': 0.8}
+DEFAULT_REPUTATION = 0.5
+
+# Links the scraper cannot turn into text
+SKIP_EXTENSIONS = ('.pdf', '.doc', '.docx', '.ppt', '.pptx', '.xls', '.xlsx', '.zip', '.mp4', '.mp3', '.jpg', '.png')
+
+
+def get_domain(url):
+    netloc = urlsplit(url).netloc.lower().split(':')[0]
+    return netloc[len('www.'):] if netloc.startswith('www.') else netloc
+
+
+def domain_reputation(domain, reputation=None):
+    reputation = DOMAIN_REPUTATION if reputation is None else reputation
+    parts = domain.split('.')
+    for i in range(len(parts) - 1):
+        parent = '.'.join(parts[i:])
+        if parent in reputation:
+            return reputation[parent]
+    return TLD_REPUTATION.get(parts[-1], DEFAULT_REPUTATION)
+
+
+class HeuristicPageSelector:
+    """
+    Picks the page to scrape from the search results without calling the LLM.
+    Each result not already visited or failed is scored on its search position, the reputation of its
+    domain and how many of the query's terms its title and snippet contain. The best result is returned
+    only if it scores at least min_confidence and beats the runner-up by min_margin; otherwise select
+    returns None and the caller falls back to the LLM picker.
+    """
+    def __init__(self, min_confidence=0.6, min_margin=0.05, position_weight=0.4, reputation_weight=0.3, overlap_weight=0.3, reputation=None):
+        self.min_confidence = min_confidence
+        self.min_margin = min_margin
+        self.position_weight = position_weight
+        self.reputation_weight = reputation_weight
+        self.overlap_weight = overlap_weight
+        self.reputation = reputation
+
+    def score(self, result, rank, query_terms):
+        position = result.get('position') or rank
+        text_terms = set(tokenize(f"{result.get('title', '')} {result.get('snippet', '')}"))
+        overlap = len(query_terms & text_terms) / len(query_terms) if query_terms else 0
+        reputation = domain_reputation(get_domain(result['link']), self.reputation)
+        return (self.position_weight / position
+                + self.reputation_weight * reputation
+                + self.overlap_weight * overlap)
+
+    def candidates(self, organic_results, visited_sites, failed_sites, domain_health=None):
+        excluded = {canonical_url(url) for url in list(visited_sites) + list(failed_sites) if url}
+        seen = set()
+        for rank, result in enumerate(organic_results, start=1):
+            link = result.get('link')
+            if not link or urlsplit(link).path.lower().endswith(SKIP_EXTENSIONS):
+                continue
+            key = canonical_url(link)
+            if key in excluded or key in seen:
+                continue
+            if domain_health is not None and domain_health.score(link) == 0:
+                continue
+            seen.add(key)
+            yield rank, result
+
+    def select(self, query, organic_results, visited_sites=(), failed_sites=(), domain_health=None):
+        """
+        Returns the URL to scrape, or None when no result is a confident choice.
+        With a DomainHealth registry, circuit-broken domains are skipped and scores are scaled by domain health.
+        """
+        with tracing.span("page_selection", strategy="heuristic") as span:
+            query_terms = set(tokenize(query))
+            scored = []
+            for rank, result in self.candidates(organic_results, visited_sites, failed_sites, domain_health):
+                score = self.score(result, rank, query_terms)
+                if domain_health is not None:
+                    score *= domain_health.score(result['link'])
+                scored.append((score, result['link']))
+            scored.sort(key=lambda scored_link: scored_link[0], reverse=True)
+            if not scored:
+                span.set_attributes(confident=False)
+                return None
+
+            best_score, best_link = scored[0]
+            margin = best_score - scored[1][0] if len(scored) > 1 else best_score
+            confident = best_score >= self.min_confidence and margin >= self.min_margin
+            span.set_attributes(confident=confident, score=round(best_score, 3), margin=round(margin, 3), candidates=len(scored))
+            return best_link if confident else None
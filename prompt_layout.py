@@ -0,0 +1,59 @@
+import re
+import string
+
+
+def placeholders(template):
+    # Names of the str.format fields in the template ("{plan}", "{outputs[sources]}" -> "plan", "outputs"),
+    # ignoring literal braces such as a JSON example in a prompt that is sent unformatted
+    try:
+        fields = [name for _, name, _, _ in string.Formatter().parse(template) if name]
+    except ValueError:
+        return set()
+    return {name for name in (re.split(r'[.\[]', field)[0] for field in fields) if name.isidentifier()}
+
+
+class PromptLayout:
+    """
+    Assembles a prompt as a static prefix followed by the parts that change between calls.
+    The instructions (formatted once with values that are fixed for the agent, such as the tool specs)
+    become the system message, identical on every call, so vLLM's automatic prefix caching, OpenAI's
+    prompt caching and Ollama's prompt cache can reuse it. The volatile sections (plan, feedback,
+    research, date...) go into the user message, most stable first, so calls within one run also
+    share as long a prefix as possible.
+    Instructions written in the older style, with section placeholders such as {plan} or {outputs},
+    are instead formatted into the system message on every call, with the query as the user message.
+    """
+    def __init__(self, instructions, sections, footer=None, **static_values):
+        fields = placeholders(instructions)
+        keys = {key for key, _ in sections}
+        self.legacy = bool(fields & keys)
+        unknown = fields - keys - set(static_values)
+        if unknown and (self.legacy or static_values):
+            raise ValueError(
+                f"Prompt has placeholders {sorted(unknown)} that are not among the values it can be "
+                f"formatted with: {sorted(keys | set(static_values))}"
+            )
+
+        self.instructions = instructions
+        self.static_values = static_values
+        # (key, label) pairs, in the order they appear in the user message
+        self.sections = sections
+        self.footer = footer
+        if self.legacy:
+            print(f"Prompt uses per-call placeholders {sorted(fields & keys)}; formatting it into the system "
+                  f"message on every call, so its prefix cannot be cached")
+            self.system_prompt = None
+        else:
+            self.system_prompt = (instructions.format(**static_values) if static_values else instructions).strip()
+
+    def build(self, **values):
+        """
+        Returns (system_prompt, user_prompt) for the given section values.
+        """
+        if self.legacy:
+            return self.instructions.format(**self.static_values, **values), str(values.get("query"))
+
+        parts = [f"{label}: `{values.get(key)}`" for key, label in self.sections]
+        if self.footer:
+            parts.append(self.footer.format(**values))
+        return self.system_prompt, "\n\n".join(parts)
@@ -9,18 +9,26 @@ If there are multiple searches, highlight the single most important search.
 
 Ensure your response takes into account any feedback (if available).
 
-Here is your previous plan: `{plan}`
-
-Here is the feedback: `{feedback}`
-
 You MUST carefully consider the feedback and adjust or change your plan based on the feedback provided.
 
 For example, if the feedback is that the plan is missing a key element, you should adjust the plan to include that element.
 
 You should be aware of today's date to help you answer questions that require current information.
-Here is today's date and time (Timezone: UTC): `{datetime}`
+
+The searches will be run with this tool:
+{tool_specs}
+
+The query, your previous plan, the feedback and today's date are given below.
 """
 
+# Volatile parts of the planning prompt, sent after the static instructions (see PromptLayout)
+planning_agent_sections = [
+    ("query", "Query"),
+    ("feedback", "Here is the feedback"),
+    ("plan", "Here is your previous plan"),
+    ("datetime", "Here is today's date and time (Timezone: UTC)"),
+]
+
 integration_agent_prompt = """
 You are an AI Integration Agent working with a planning agent.
 
@@ -39,14 +47,8 @@ In your comprehensive response, you MUST do the following:
 2. Directly provide the source of the information in the response.
 The research is a dictionary that provides research content alongside its source.
 
-research: `{outputs}`
-
-Here is the plan from the planning agent: `{plan}`
-
 You must fully cite the sources provided in the research.
 
-Sources from research: `{sources}`
-
 Do not use sources that have not been provided in the research.
 
 Example Response:
@@ -61,20 +63,26 @@ Sources:
 : https://example.com/science/sunrise-sunset-colors
 
 There is a quality assurance process to check your response meets the requirements.
-
-Here are the results of the last quality assurance check: `{reason}`
-
-Take these into account when generating your response.
-
-Here are all your previous responses: `{previous_response}`
+Take the results of the last quality assurance check into account when generating your response.
 
 Your previous responses may partially answer the original user query, you should consider this when generating your response.
 
-Here is today's date and time (Timezone: UTC): `{datetime}`
-
-Here's a reminder of the original user query: `{query}`
+The original query, your previous responses, the plan, the research, its sources, the results of the last
+quality assurance check and today's date are given below.
 """
 
+# Volatile parts of the integration prompt, from the most to the least stable within one run
+integration_agent_sections = [
+    ("query", "Here is the original user query"),
+    ("previous_response", "Here are all your previous responses"),
+    ("plan", "Here is the plan from the planning agent"),
+    ("outputs", "research"),
+    ("sources", "Sources from research"),
+    ("reason", "Here are the results of the last quality assurance check"),
+    ("datetime", "Here is today's date and time (Timezone: UTC)"),
+]
+integration_agent_footer = "Here's a reminder of the original user query: `{query}`"
+
 
 check_response_prompt = """
 Check if the response meets all of the requirements of the query based on the following:
@@ -103,6 +111,14 @@ The json object should have the following format:
 """
 
 
+check_response_sections = [
+    ("query", "query"),
+    ("previous_response", "previous response"),
+    ("response", "response"),
+    ("datetime", "current datetime"),
+]
+
+
 generate_searches_prompt = """
 Return a json object that gives the input to a google search engine that could be used to find an answer to the Query based on the Plan.
 You may be given a multiple questions to answer, but you should only generate the search engine query for the single most important question according to the Plan and query. 
@@ -113,6 +129,18 @@ The json object should have the following format:
 """
 
 
+generate_multiple_searches_prompt = """
+Return a json object that gives several inputs to a google search engine that together could be used to find an answer to the Query based on the Plan.
+Generate the number of searches you are asked for. Make the searches diverse: cover different questions from the Plan,
+and phrase searches for the same question differently (synonyms, more specific or more general terms), so that together
+they find more relevant websites than any single search.
+The json object should have the following format:
+{
+    'response': ['search engine query', 'search engine query', ...]
+}
+"""
+
+
 get_search_page_prompt = """
 Return a json object that gives the URL of the best website source to answer the Query,
 Plan and Search Results. The URL MUST be selected
@@ -162,6 +190,19 @@ generate_searches_json = {
     "required": ["response"]
 }
 
+generate_multiple_searches_json = {
+    "type": "object",
+    "properties": {
+        "response": {
+            "type": "array",
+            "items": {
+                "type": "string"
+            }
+        }
+    },
+    "required": ["response"]
+}
+
 get_search_page_json = {
     "type": "object",
     "properties": {
@@ -0,0 +1,140 @@
+import re
+import math
+import tracing
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from tokens import count_tokens, truncate_tokens
+
+
+# Query parameters that only track where a click came from and never change the page
+TRACKING_PARAMS = {'gclid', 'fbclid', 'msclkid', 'ref'}
+
+
+def canonical_url(url):
+    # Lower-cases the host and drops 'www.', fragments, tracking parameters, trailing slashes and the
+    # http/https difference, so the same page returned by two searches is recognised as one result
+    parts = urlsplit(url.strip())
+    scheme = 'https' if parts.scheme.lower() in ('http', 'https') else parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if netloc.startswith('www.'):
+        netloc = netloc[len('www.'):]
+    query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+             if not key.lower().startswith('utm_') and key.lower() not in TRACKING_PARAMS]
+    path = parts.path.rstrip('/') or '/'
+    return urlunsplit((scheme, netloc, path, urlencode(query), ''))
+
+
+def reciprocal_rank_fusion(result_lists, k=60, max_results=None):
+    """
+    Merges several ranked lists of Serper organic results into one deduplicated list.
+    Each result scores sum(1 / (k + rank)) over the lists it appears in, so pages found by several
+    queries, or ranked highly by one, come first. The first copy seen of each page is kept, with its
+    fused 'position' and 'rrf_score'.
+    """
+    scores = {}
+    results = {}
+    for organic_results in result_lists:
+        seen = set()
+        for rank, result in enumerate(organic_results, start=1):
+            link = result.get('link')
+            if not link:
+                continue
+            key = canonical_url(link)
+            # A page repeated within one list only counts at its best rank
+            if key in seen:
+                continue
+            seen.add(key)
+            scores[key] = scores.get(key, 0) + 1 / (k + rank)
+            results.setdefault(key, result)
+
+    ranked = sorted(scores, key=scores.get, reverse=True)[:max_results]
+    return [
+        dict(results[key], position=position, rrf_score=round(scores[key], 6))
+        for position, key in enumerate(ranked, start=1)
+    ]
+
+
+TOKEN_RE = re.compile(r'\w+')
+
+# Words too common to say anything about a passage's relevance
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'how', 'in', 'is', 'it', 'of', 'on', 'or',
+    'that', 'the', 'this', 'to', 'was', 'what', 'when', 'where', 'which', 'who', 'why', 'will', 'with',
+}
+
+
+def tokenize(text):
+    return [token for token in TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+def split_passages(text, passage_words=120):
+    # Consecutive, non-overlapping windows of passage_words words
+    words = text.split()
+    return [' '.join(words[start:start + passage_words]) for start in range(0, len(words), passage_words)]
+
+
+class BM25Index:
+    """
+    Okapi BM25 over the passages of one page.
+    The inverted index (term -> {passage: term frequency}) is built once, so scoring a query only touches
+    the postings of its own terms.
+    """
+    def __init__(self, passages, k1=1.5, b=0.75):
+        self.passages = passages
+        self.k1 = k1
+        self.b = b
+        self.index = {}
+        self.lengths = []
+
+        for i, passage in enumerate(passages):
+            tokens = tokenize(passage)
+            self.lengths.append(len(tokens))
+            for token in tokens:
+                postings = self.index.setdefault(token, {})
+                postings[i] = postings.get(i, 0) + 1
+
+        self.average_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0
+
+    def idf(self, term):
+        # BM25+ style idf that stays positive for terms present in most passages
+        df = len(self.index.get(term, ()))
+        return math.log(1 + (len(self.passages) - df + 0.5) / (df + 0.5))
+
+    def scores(self, query):
+        scores = [0.0] * len(self.passages)
+        for term in set(tokenize(query)):
+            postings = self.index.get(term)
+            if not postings:
+                continue
+            idf = self.idf(term)
+            for i, tf in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[i] / (self.average_length or 1))
+                scores[i] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+
+def select_passages(text, query, max_tokens=1500, passage_words=120, separator="\n...\n"):
+    """
+    Keeps the passages of the text that best match the query, within max_tokens.
+    Passages are ranked with BM25 and the best ones that fit the budget are returned in their original
+    order. If no passage mentions any query term, the start of the text is kept instead.
+    """
+    passages = split_passages(text, passage_words)
+    scores = BM25Index(passages).scores(query)
+    ranked = sorted((i for i, score in enumerate(scores) if score > 0), key=lambda i: scores[i], reverse=True)
+
+    if not ranked:
+        return truncate_tokens(text, max_tokens)
+
+    selected = []
+    budget = max_tokens
+    for i in ranked:
+        tokens = count_tokens(passages[i]) + count_tokens(separator)
+        if tokens <= budget:
+            selected.append(i)
+            budget -= tokens
+
+    if not selected:
+        return truncate_tokens(text, max_tokens)
+
+    tracing.set_attributes(passages=len(passages), selected_passages=len(selected), passage_tokens=max_tokens - budget)
+    return separator.join(passages[i] for i in sorted(selected))
@@ -1,13 +1,21 @@
 import requests
-from bs4 import BeautifulSoup
 import json
 import yaml
 from termcolor import colored
 import os
-import chardet
-import string
-import ast
-from prompts import generate_searches_prompt, get_search_page_prompt, generate_searches_json, get_search_page_json
+import time
+import tracing
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+from llm_backends import get_backend
+from http_client import HTTPClient, is_text_content_type, iter_body, read_head, chain_head, timed_chunks
+from encoding import default_resolver
+from text_quality import is_garbled
+from cache import SearchCache, PageCache, normalize_query
+from ranking import reciprocal_rank_fusion, select_passages
+from page_selection import HeuristicPageSelector
+from domain_health import DomainHealth
+from extract import extract_text, extract_stream
+from prompts import generate_searches_prompt, get_search_page_prompt, generate_searches_json, get_search_page_json, generate_multiple_searches_prompt, generate_multiple_searches_json
 
 
 def load_config(file_path):
@@ -27,202 +35,152 @@ class WebSearcher:
     The source is useful for citation purposes in the final response to the user query.
     The content is used to generate a comprehensive response to the user query.
     """
-    def __init__(self, model, verbose=False, model_endpoint=None, server=None, stop=None):
+    def __init__(self, model, verbose=False, model_endpoint=None, server=None, stop=None, http_client=None, parallel_pages=0, page_deadline=20, merge_pages=False, search_cache=None, page_cache=None, extractor='fast', max_words=4000, max_bytes=2 * 1024 * 1024, encoding_resolver=None, speculative_pages=0, prefetch_search=False, max_workers=16, search_endpoint="https://google.serper.dev/search", num_searches=1, max_results=20, passage_tokens=None, passage_words=120, scan_words=20000, page_selector=None, domain_health=None, completion_memo=None):
         self.server = server
         self.model_endpoint = model_endpoint
+        self.http_client = http_client or HTTPClient()
         load_config('config.yaml')
-        if server == 'openai':
-            self.api_key = os.getenv("OPENAI_API_KEY")
-            self.headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {self.api_key}'
-        }
-        else:
-            self.headers = {"Content-Type": "application/json"}
+        self.api_key = os.getenv("OPENAI_API_KEY") if server == 'openai' else None
         self.model = model
+        self.search_endpoint = search_endpoint
+        self.llm = get_backend(server, model, model_endpoint, self.http_client, api_key=self.api_key, stop=stop, memo=completion_memo)
         self.verbose = verbose
 
         # self.failed_sites = []
         self.stop = stop
 
+        # Number of top search results to scrape concurrently (0 keeps the sequential LLM page selection)
+        self.parallel_pages = parallel_pages
+        self.page_deadline = page_deadline
+        self.merge_pages = merge_pages
+
+        # Optional persistent cache of Serper results (a SearchCache, or True for the default one)
+        self.search_cache = SearchCache() if search_cache is True else search_cache
+        # Optional cache of cleaned page text, revalidated with conditional GETs (a PageCache, or True)
+        self.page_cache = PageCache() if page_cache is True else page_cache
+
+        # HTML-to-text engine ('fast', 'lxml' or 'bs4') and the number of words kept per page
+        self.extractor = extractor
+        self.max_words = max_words
+        # Upper bound on the bytes downloaded per page
+        self.max_bytes = max_bytes
+        self.encoding_resolver = encoding_resolver or default_resolver
+
+        # Pages scraped speculatively while get_search_page decides, and whether the Agent should
+        # prefetch Serper results for the raw query while planning
+        self.speculative_pages = speculative_pages
+        self.prefetch_search = prefetch_search
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+        # Number of diverse searches generated and fetched concurrently per step (1 keeps the single search);
+        # their results are merged with reciprocal rank fusion, keeping the top max_results
+        self.num_searches = num_searches
+        self.max_results = max_results
+
+        # With a passage token budget, up to scan_words words are extracted per page and only the
+        # passages that best match the query (BM25) are kept, instead of the first max_words words
+        self.passage_tokens = passage_tokens
+        self.passage_words = passage_words
+        self.scan_words = scan_words
+
+        # Optional local page selector (a HeuristicPageSelector, or True for the default one) tried before
+        # the LLM picker; the LLM is only asked when the selector is not confident
+        self.page_selector = HeuristicPageSelector() if page_selector is True else page_selector
+
+        # Optional persistent per-domain health registry (a DomainHealth, or True for the default one):
+        # domains that keep failing or block scrapers are skipped without a request and ranked down
+        self.domain_health = DomainHealth() if domain_health is True else domain_health
+
+    @property
+    def page_words(self):
+        # Words extracted per page: the whole scan window when passages are ranked afterwards
+        return self.scan_words if self.passage_tokens else self.max_words
+
+    def is_healthy(self, url):
+        # False while the url's domain is circuit broken
+        return self.domain_health is None or self.domain_health.score(url) > 0
+
+    def select_content(self, results_dict, search_text):
+        # Replaces the page text with its passages most relevant to the query, within the token budget
+        if not self.passage_tokens or not results_dict or not results_dict.get('content'):
+            return results_dict
+        with tracing.span("passage_ranking", source=results_dict.get('source')):
+            content = select_passages(results_dict['content'], search_text, max_tokens=self.passage_tokens, passage_words=self.passage_words)
+        return dict(results_dict, content=content)
+
+    @tracing.traced("search_generation")
     def generate_searches(self, plan, query):
 
-        if self.server == 'ollama':
-
-            payload = {
-                "model": self.model,
-                "prompt": f"Query: {query}\n\nPlan: {plan}",
-                "format": "json",
-                "system": generate_searches_prompt,
-                "stream": False,
-                "temperature": 0,
-            }
-        
-        if self.server == 'runpod' or self.server == 'openai':
-
-            prefix = self.model.split('/')[0]
-            exception_models = ['microsoft/Phi-3-medium-128k-instruct',
-                                'microsoft/Phi-3-mini-128k-instruct',
-                                'microsoft/Phi-3-medium-4k-instruct',
-                                'microsoft/Phi-3-mini-4k-instruct',
-                                ]
-
-            if prefix == 'mistralai' or self.model in exception_models:
-                payload = {
-                    "model": self.model,
-                    "response_format": {"type": "json_object"},
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": f"System: {generate_searches_prompt} \n\n\ Query: {query}\n\nPlan: {plan}"
-                        }
-                    ],
-                    "temperature": 0,
-                    "stop": None,
-                    "guided_json": generate_searches_json
-                }
-
-            else:
-                payload = {
-                    "model": self.model,
-                    "response_format": {"type": "json_object"},
-                    "messages": [
-                        {
-                            "role": "system",
-                            "content": generate_searches_prompt
-                        },
-                        {
-                            "role": "user",
-                            "content": f"Query: {query}\n\nPlan: {plan}"
-                        }
-                    ],
-                    "temperature": 0,
-                    "stop": self.stop,
-                    "guided_json": generate_searches_json
-
-                }
-
-            if self.server == 'openai':
-               del payload["stop"]
-               del payload["guided_json"]
-
         try: 
-            response = requests.post(self.model_endpoint, headers=self.headers, data=json.dumps(payload))
-            print(f"Response_DEBUG: {response}")
-            try:
-                response_dict = response.json()
-            except json.JSONDecodeError:
-                response_dict = ast.literal_eval(response.content)
-
-            if self.server == 'ollama':
-                response_json = json.loads(response_dict['response'])
-                print(f"Response JSON: {response_json}")
-                search_query = response_json.get('response', '')
-
-            if self.server == 'runpod' or self.server == 'openai':
-                response_content = response_dict['choices'][0]['message']['content']
-
-                try:
-                    response_json = json.loads(response_content)
-                except json.JSONDecodeError:
-                    response_json = ast.literal_eval(response_content)
-
-                search_query = response_json.get('response', '')
-            
+            response_json = self.llm.complete_json(generate_searches_prompt, f"Query: {query}\n\nPlan: {plan}", json_schema=generate_searches_json)
+            search_query = response_json.get('response', '')
             print(f"Search Query: {search_query}")
 
             return search_query
         
         except Exception as e:
-            print("Error in response:", response_dict)
+            print("Error in response:", e)
             return "Error generating search query"
-        
-    def get_search_page(self, plan, query, search_results, failed_sites=[], visited_sites=[]):
-
-        if self.server == 'ollama':
-            payload = {
-                "model": self.model,
-                "prompt": f"Query: {query}\n\nPlan: {plan} \n\nSearch Results: {search_results}\n\nFailed Sites: {failed_sites}\n\nVisited Sites: {visited_sites}",
-                "format": "json",
-                "system": get_search_page_prompt,
-                "stream": False,
-                "temperature": 0,
-            }
-        
-        if self.server == 'runpod' or self.server == 'openai':
-
-            prefix = self.model.split('/')[0]
-            exception_models = ['microsoft/Phi-3-medium-128k-instruct',
-                                'microsoft/Phi-3-mini-128k-instruct',
-                                'microsoft/Phi-3-medium-4k-instruct',
-                                'microsoft/Phi-3-mini-4k-instruct',
-                                ]
-
-            if prefix == 'mistralai' or self.model in exception_models:
-                payload = {
-                    "model": self.model,
-                    "response_format": {"type": "json_object"},
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": f"System: {get_search_page_prompt} \n\n\ Query: {query}\n\nPlan: {plan}\n\nSearch Results: {search_results} \n\nFailed Sites: {failed_sites}\n\nVisited Sites: {visited_sites}"
-                        }
-                    ],
-                    "temperature": 0,
-                    "stop": None,
-                    "guided_json": get_search_page_json
-                }
 
-            else:
-                payload = {
-                    "model": self.model,
-                    "response_format": {"type": "json_object"},
-                    "messages": [
-                        {
-                            "role": "system",
-                            "content": get_search_page_prompt
-                        },
-                        {
-                            "role": "user",
-                            "content": f"Query: {query}\n\nPlan: {plan}\n\nSearch Results: {search_results} \n\nFailed Sites: {failed_sites}\n\nVisited Sites: {visited_sites}"
-                        }
-                    ],
-                    "temperature": 0,
-                    "stop": self.stop,
-                    "guided_json": get_search_page_json
-                }
-
-            if self.server == 'openai':
-                del payload["stop"]
-                del payload["guided_json"]
+    @tracing.traced("search_generation")
+    def generate_multiple_searches(self, plan, query):
+        prompt = f"Query: {query}\n\nPlan: {plan}\n\nNumber of searches: {self.num_searches}"
 
-        try: 
-            response = requests.post(self.model_endpoint, headers=self.headers, data=json.dumps(payload))
-            try:
-                response_dict = response.json()
-            except json.JSONDecodeError:
-                response_dict = ast.literal_eval(response.content)
+        try:
+            response_json = self.llm.complete_json(generate_multiple_searches_prompt, prompt, json_schema=generate_multiple_searches_json)
+            response = response_json.get('response', [])
+            if isinstance(response, str):
+                response = [response]
+
+            # Near-identical searches would only fetch the same results twice
+            search_queries = []
+            seen = set()
+            for search_query in response:
+                if isinstance(search_query, str) and search_query.strip() and normalize_query(search_query) not in seen:
+                    seen.add(normalize_query(search_query))
+                    search_queries.append(search_query.strip())
+            search_queries = search_queries[:self.num_searches]
+            tracing.set_attributes(searches=len(search_queries))
+            print(f"Search Queries: {search_queries}")
+
+            return search_queries
 
-            if self.server == 'ollama':
-                response_json = json.loads(response_dict['response'])
-                search_query = response_json.get('response', '')
+        except Exception as e:
+            print("Error in response:", e)
+            return []
+        
+    @tracing.traced("page_selection")
+    def get_search_page(self, plan, query, search_results, failed_sites=None, visited_sites=None):
+        failed_sites = failed_sites if failed_sites is not None else []
+        visited_sites = visited_sites if visited_sites is not None else []
 
-            if self.server == 'runpod' or self.server == 'openai':
-                response_content = response_dict['choices'][0]['message']['content']
+        prompt = f"Query: {query}\n\nPlan: {plan}\n\nSearch Results: {search_results} \n\nFailed Sites: {failed_sites}\n\nVisited Sites: {visited_sites}"
 
-                try:
-                    response_json = json.loads(response_content)
-                except json.JSONDecodeError:
-                    response_json = ast.literal_eval(response_content)
+        tracing.set_attributes(strategy="llm")
 
-                search_query = response_json.get('response', '')
+        try: 
+            response_json = self.llm.complete_json(get_search_page_prompt, prompt, json_schema=get_search_page_json)
+            search_query = response_json.get('response', '')
            
             return search_query
         
         except Exception as e:
-            print("Error in response:", response_dict)
+            print("Error in response:", e)
             return "Error getting search page URL"
     
+    def choose_page(self, plan, query, search_results, organic_results, search_text, failed_sites=None, visited_sites=None):
+        # Local selection first, falling back to the LLM picker when it is not confident
+        if self.page_selector is not None:
+            best_page = self.page_selector.select(search_text, organic_results, visited_sites=visited_sites or [], failed_sites=failed_sites or [], domain_health=self.domain_health)
+            if best_page:
+                print(f"Selected page without the LLM: {best_page}")
+                return best_page
+
+        # Pages on circuit-broken domains are shown to the LLM as failed sites
+        unhealthy = [result['link'] for result in organic_results if result.get('link') and not self.is_healthy(result['link'])]
+        failed_sites = list(failed_sites or []) + [link for link in unhealthy if link not in (failed_sites or [])]
+        return self.get_search_page(plan, query, search_results, failed_sites=failed_sites, visited_sites=visited_sites)
+
     def format_results(self, organic_results):
 
         result_strings = []
@@ -234,35 +192,101 @@ class WebSearcher:
         
         return '\n'.join(result_strings)
     
-    def fetch_search_results(self, search_queries):
+    @tracing.traced("serper")
+    def fetch_organic_results(self, search_queries):
 
-        search_url = "https://google.serper.dev/search"
+        if self.search_cache is not None:
+            organic_results = self.search_cache.get(search_queries)
+            tracing.set_attributes(cache_hit=organic_results is not None)
+            if organic_results is not None:
+                print(f"Search cache hit: {search_queries}")
+                return organic_results
+
+        search_url = self.search_endpoint
         headers = {
             'Content-Type': 'application/json',
             'X-API-KEY': os.environ['SERPER_DEV_API_KEY']  # Ensure this environment variable is set with your API key
         }
         payload = json.dumps({"q": search_queries})
-        
-        # Attempt to make the HTTP POST request
+
+        response = self.http_client.post(search_url, headers=headers, data=payload)
+        response.raise_for_status()  # Raise an HTTPError for bad responses (4XX, 5XX)
+        results = response.json()
+        organic_results = results.get('organic', [])
+        tracing.set_attributes(results=len(organic_results), response_bytes=len(response.content))
+
+        if self.search_cache is not None and organic_results:
+            self.search_cache.set(search_queries, organic_results)
+
+        return organic_results
+
+    def search(self, search_queries):
+        # Returns the formatted results for the LLM alongside the raw organic results
         try:
-            response = requests.post(search_url, headers=headers, data=payload)
-            response.raise_for_status()  # Raise an HTTPError for bad responses (4XX, 5XX)
-            results = response.json()
-            
+            organic_results = self.fetch_organic_results(search_queries)
+
             # Check if 'organic' results are in the response
-            if 'organic' in results:
-                return self.format_results(results['organic'])
+            if organic_results:
+                return self.format_results(organic_results), organic_results
             else:
-                return "No organic results found."
+                return "No organic results found.", []
 
         except requests.exceptions.HTTPError as http_err:
-            return f"HTTP error occurred: {http_err}"
+            return f"HTTP error occurred: {http_err}", []
         except requests.exceptions.RequestException as req_err:
-            return f"Request exception occurred: {req_err}"
+            return f"Request exception occurred: {req_err}", []
         except KeyError as key_err:
-            return f"Key error in handling response: {key_err}"
-        
-    def scrape_website_content(self, website_url, failed_sites=[]):
+            return f"Key error in handling response: {key_err}", []
+
+    def search_many(self, search_queries):
+        """
+        Fetches the results of several searches concurrently and merges them into one deduplicated,
+        rank-fused list. Searches that fail are left out of the merge.
+        """
+        with tracing.span("search_fanout", searches=len(search_queries)) as span:
+            futures = [tracing.submit(self.executor, self.fetch_organic_results, search_query) for search_query in search_queries]
+
+            result_lists = []
+            for search_query, future in zip(search_queries, futures):
+                try:
+                    result_lists.append(future.result())
+                except (requests.exceptions.RequestException, KeyError) as e:
+                    print(f"Search for '{search_query}' failed: {e}")
+
+            organic_results = reciprocal_rank_fusion(result_lists, max_results=self.max_results)
+            span.set_attributes(results=sum(len(results) for results in result_lists), merged_results=len(organic_results))
+
+        if organic_results:
+            return self.format_results(organic_results), organic_results
+        return "No organic results found.", []
+
+    def fetch_search_results(self, search_queries):
+        search_results, _ = self.search(search_queries)
+        return search_results
+
+    def scrape_website_content(self, website_url, failed_sites=None):
+        with tracing.span("scrape", url=website_url) as span:
+            start = time.perf_counter()
+            results_dict, failed, success = self._scrape_website_content(website_url, failed_sites=failed_sites)
+            span.set_attributes(success=success)
+
+            if self.domain_health is not None:
+                self.record_health(website_url, span, success, results_dict, (time.perf_counter() - start) * 1000)
+            return results_dict, failed, success
+
+    def record_health(self, website_url, span, success, results_dict, latency_ms):
+        # Cache hits and short circuits say nothing about the site, and missing or empty pages and unsupported
+        # content types are a property of the page
+        status = span.attributes.get('status')
+        if span.attributes.get('cache') == "hit" or span.attributes.get('failure') in ("circuit_open", "content_type", "empty") or status in (404, 410):
+            return
+        if success:
+            self.domain_health.record_success(website_url, latency_ms=latency_ms, status=status)
+        else:
+            self.domain_health.record_failure(website_url, results_dict.get('content'), latency_ms=latency_ms, status=status)
+
+    def _scrape_website_content(self, website_url, failed_sites=None):
+        failed_sites = failed_sites if failed_sites is not None else []
         headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.110 Safari/537.36',
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9',
@@ -273,72 +297,268 @@ class WebSearcher:
             'Accept-Encoding': 'gzip, deflate, br'
         }
 
-        def is_garbled(text):
-            # Count non-ASCII characters
-            non_ascii_chars = sum(1 for char in text if char not in string.printable)
-            try:
-                # Calculate the proportion of non-ASCII characters
-                return non_ascii_chars / len(text) > 0.2
-            except ZeroDivisionError:
-                # If the text is empty, it cannot be garbled
-                return False
+        cached = None
+        if self.page_cache is not None:
+            entry = self.page_cache.get_entry(website_url)
+            if entry is not None:
+                cached, fresh = entry
+                if fresh:
+                    tracing.set_attributes(cache="hit")
+                    self.page_cache.record(True)
+                    return {"source": website_url, "content": cached["content"]}, "N/A", True
+
+                # Stale entry: ask the server whether the page changed since we cached it
+                if cached.get('etag'):
+                    headers['If-None-Match'] = cached['etag']
+                if cached.get('last_modified'):
+                    headers['If-Modified-Since'] = cached['last_modified']
+
+        if self.domain_health is not None and not self.domain_health.allow(website_url):
+            # Skip domains that recently kept failing or blocked us instead of waiting for another timeout;
+            # only the network fetch is skipped, a fresh cached copy of the page is still served above
+            print(f"Skipping {website_url}: its domain is failing or blocking scrapers.")
+            tracing.set_attributes(failure="circuit_open")
+            failed_sites.append(website_url)
+            failed = {"source": website_url, "content": "Failed to retrieve content because the domain is failing or blocking scrapers"}
+            return failed, failed_sites, False
 
-        
         try:
-            # Making a GET request to the website
-            response = requests.get(website_url, headers=headers, timeout=15)
-            response.raise_for_status()  # This will raise an exception for HTTP errors
-            
-            # Detecting encoding using chardet
-            detected_encoding = chardet.detect(response.content)
-            response.encoding = detected_encoding['encoding'] if detected_encoding['confidence'] > 0.5 else 'utf-8'
-            
-            # Handling possible issues with encoding detection
-            try:
-                content = response.text
-            except UnicodeDecodeError:
-                content = response.content.decode('utf-8', errors='replace')
-            
-            # Parsing the page content using BeautifulSoup
-            soup = BeautifulSoup(content, 'html.parser')
-            text = soup.get_text(separator='\n')
-            # Cleaning up the text: removing excess whitespace
-            clean_text = '\n'.join([line.strip() for line in text.splitlines() if line.strip()])
-            split_text = clean_text.split()
-            first_5k_words = split_text[:4000]
-            clean_text_5k = ' '.join(first_5k_words)
-
-            if is_garbled(clean_text):
+            # Making a streamed GET request so only the headers are read up front
+            response = self.http_client.get_page(website_url, headers=headers, timeout=15, stream=True)
+
+            with response:
+                # Time until the response headers arrived: DNS, connect, TLS and server time
+                tracing.set_attributes(status=response.status_code, time_to_headers_ms=response.elapsed.total_seconds() * 1000)
+
+                if response.status_code == 304 and cached is not None:
+                    tracing.set_attributes(cache="revalidated")
+                    self.page_cache.touch(website_url)
+                    self.page_cache.record_revalidated()
+                    return {"source": website_url, "content": cached["content"]}, "N/A", True
+
+                response.raise_for_status()  # This will raise an exception for HTTP errors
+
+                # Skip PDFs, images and other binary content before downloading the body
+                content_type = response.headers.get('Content-Type', '')
+                if not is_text_content_type(content_type):
+                    print(f"Failed to retrieve content from {website_url} due to unsupported content type {content_type}.")
+                    tracing.set_attributes(failure="content_type")
+                    failed = {"source": website_url, "content": f"Failed to retrieve content due to unsupported content type {content_type}"}
+                    failed_sites.append(website_url)
+                    return failed, failed_sites, False
+
+                # At most max_bytes of the body are ever read
+                chunks = timed_chunks(iter_body(response, max_bytes=self.max_bytes))
+                body_start = time.perf_counter()
+
+                # Resolving the encoding from the headers, <meta charset> or a bounded sample of the body
+                head, rest = read_head(chunks, self.encoding_resolver.sample_bytes)
+                encoding = self.encoding_resolver.resolve(content_type, head)
+
+                if self.extractor == 'fast':
+                    # Decode and extract as the body arrives, closing the connection once enough text is collected
+                    clean_text_5k = extract_stream(chain_head(head, rest), encoding, max_words=self.page_words)
+                else:
+                    content = b''.join(chain_head(head, rest)).decode(encoding, errors='replace')
+
+                    # Extracting the first max_words words of text with the configured engine
+                    clean_text_5k = extract_text(content, engine=self.extractor, max_words=self.page_words)
+
+                # Extraction time is whatever was not spent waiting for the network
+                body_ms = (time.perf_counter() - body_start) * 1000
+                tracing.set_attributes(parse_ms=body_ms - tracing.get_attribute('download_ms', 0))
+
+            if not clean_text_5k.strip():
+                print(f"Failed to retrieve content from {website_url} due to no text on the page.")
+                tracing.set_attributes(failure="empty")
+                failed = {"source": website_url, "content": "Failed to retrieve content because the page has no text"}
+                failed_sites.append(website_url)
+                return failed, failed_sites, False
+
+            if is_garbled(clean_text_5k):
                 print(f"Failed to retrieve content from {website_url} due to garbled text.")
+                tracing.set_attributes(failure="garbled")
                 failed = {"source": website_url, "content": "Failed to retrieve content due to garbled text"}
                 failed_sites.append(website_url)
                 return failed, failed_sites, False
             
+            if self.page_cache is not None:
+                tracing.set_attributes(cache="miss")
+                self.page_cache.record(False)
+                self.page_cache.set(website_url, {
+                    "content": clean_text_5k,
+                    "etag": response.headers.get('ETag'),
+                    "last_modified": response.headers.get('Last-Modified')
+                })
 
             return {"source": website_url, "content": clean_text_5k}, "N/A",  True
 
         except requests.exceptions.RequestException as e:
             print(f"Error retrieving content from {website_url}: {e}")
+            tracing.set_attributes(failure="error")
             failed = {"source": website_url, "content": f"Failed to retrieve content due to an error: {e}"}
             failed_sites.append(website_url)
             return failed, failed_sites, False
         
-    def use_tool(self, plan=None, query=None, visited_sites=[], failed_sites=[]):
+    def scrape_parallel(self, organic_results, visited_sites=None, failed_sites=None, search_text=None):
+        # Scrape the top-N candidate links concurrently, each bounded by the page deadline.
+        # Returns the best-ranked successful page, or all successful pages merged if merge_pages is set.
+        visited_sites = visited_sites if visited_sites is not None else []
+        failed_sites = failed_sites if failed_sites is not None else []
+
+        candidates = []
+        for result in organic_results:
+            link = result.get('link')
+            if link and link not in visited_sites and link not in failed_sites and link not in candidates and self.is_healthy(link):
+                candidates.append(link)
+        candidates = candidates[:self.parallel_pages]
+
+        if not candidates:
+            return None
+
+        executor = ThreadPoolExecutor(max_workers=len(candidates))
+        futures = {tracing.submit(executor, self.scrape_website_content, url, failed_sites): rank for rank, url in enumerate(candidates)}
+        results = [None] * len(candidates)
+
+        try:
+            for future in as_completed(futures, timeout=self.page_deadline):
+                rank = futures[future]
+                try:
+                    results_dict, _, success = future.result()
+                except Exception as e:
+                    print(f"Error retrieving content from {candidates[rank]}: {e}")
+                    results_dict, success = None, False
+                if success and search_text:
+                    results_dict = self.select_content(results_dict, search_text)
+                results[rank] = results_dict if success else False
+
+                if not self.merge_pages:
+                    # Return as soon as every better-ranked candidate has failed
+                    for result in results:
+                        if result is None:
+                            break
+                        if result:
+                            return result
+
+        except FuturesTimeoutError:
+            print(f"Page deadline of {self.page_deadline}s reached while scraping {candidates}")
+
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        for rank, result in enumerate(results):
+            if result is None:
+                failed_sites.append(candidates[rank])
+
+        successful = [result for result in results if result]
+        if not successful:
+            return None
+
+        if not self.merge_pages:
+            return successful[0]
+
+        return {
+            "source": successful[0]["source"],
+            "sources": [result["source"] for result in successful],
+            "content": "\n\n".join(f"Source: {result['source']}\n{result['content']}" for result in successful)
+        }
+
+    def prefetch(self, query):
+        # Starts the Serper call for the raw user query in the background, e.g. while the planning agent runs
+        return tracing.submit(self.executor, self.search, query)
+
+    def merge_prefetched(self, organic_results, prefetched):
+        # Appends the prefetched results that the generated search did not already return
+        try:
+            _, prefetched_results = prefetched.result(timeout=self.page_deadline)
+        except Exception as e:
+            print(f"Prefetched search failed: {e}")
+            return organic_results
+
+        links = {result.get('link') for result in organic_results}
+        merged = organic_results + [result for result in prefetched_results if result.get('link') not in links]
+        # Positions are renumbered over the merged list, so a prefetched result keeps its place after the
+        # generated search's hits instead of tying with them on its original Serper position
+        return [dict(result, position=position) for position, result in enumerate(merged, start=1)]
+
+    def start_speculative_scrapes(self, organic_results, visited_sites, failed_sites):
+        # Scrapes the top candidates in the background while the LLM is still choosing a page
+        speculative = {}
+        for result in organic_results:
+            if len(speculative) >= self.speculative_pages:
+                break
+            link = result.get('link')
+            if link and link not in visited_sites and link not in failed_sites and link not in speculative and self.is_healthy(link):
+                speculative[link] = tracing.submit(self.executor, self.scrape_website_content, link, failed_sites)
+        return speculative
+
+    def take_scrape(self, url, speculative, failed_sites):
+        # Uses the speculative scrape of the chosen page if there is one, otherwise scrapes it now
+        future = speculative.pop(url, None)
+        if future is not None:
+            try:
+                results_dict, _, response = future.result(timeout=self.page_deadline)
+                print(f"Using speculatively scraped page {url}")
+                return results_dict, response
+            except Exception as e:
+                print(f"Speculative scrape of {url} failed: {e}")
+                future.cancel()
+
+        results_dict, _, response = self.scrape_website_content(url, failed_sites=failed_sites)
+        return results_dict, response
+
+    def use_tool(self, plan=None, query=None, visited_sites=None, failed_sites=None, prefetched=None):
+        visited_sites = visited_sites if visited_sites is not None else []
+        failed_sites = failed_sites if failed_sites is not None else []
+
+        search_queries = self.generate_multiple_searches(plan, query) if self.num_searches > 1 else None
+        if search_queries:
+            search_results, organic_results = self.search_many(search_queries)
+        else:
+            search_queries = self.generate_searches(plan, query)
+            search_results, organic_results = self.search(search_queries)
+
+        # What the page passages are scored against
+        search_text = f"{query} {' '.join(search_queries) if isinstance(search_queries, list) else search_queries}"
+
+        if prefetched is not None:
+            organic_results = self.merge_prefetched(organic_results, prefetched)
+            if organic_results:
+                search_results = self.format_results(organic_results)
+
+        if self.parallel_pages:
+            results_dict = self.scrape_parallel(organic_results, visited_sites=visited_sites, failed_sites=failed_sites, search_text=search_text)
+            if results_dict:
+                if self.verbose:
+                    print(f"Search Engine Query: {search_queries}")
+                    print(colored(f"SEARCH RESULTS {search_results}", 'yellow'))
+                    print(colored(f"RESULTS DICT {results_dict}", 'yellow'))
+                return results_dict
+            print("Parallel scraping found no usable page...Falling back to page selection")
+
+        speculative = self.start_speculative_scrapes(organic_results, visited_sites, failed_sites) if self.speculative_pages else {}
+
+        try:
+            best_page = self.choose_page(plan, query, search_results, organic_results, search_text, failed_sites=failed_sites, visited_sites=visited_sites)
+            results_dict, response = self.take_scrape(best_page, speculative, failed_sites)
+
+            attempts = 0
 
-        search_queries = self.generate_searches(plan, query)
-        search_results = self.fetch_search_results(search_queries)
-        best_page = self.get_search_page(plan, query, search_results, visited_sites=visited_sites)
-        results_dict, failed_sites, response = self.scrape_website_content(best_page, failed_sites=failed_sites)
+            while not response and attempts < 5:
+                print(f"Failed to retrieve content from {best_page}...Trying a different page")
+                print(f"Failed Sites: {failed_sites}")
+                best_page = self.choose_page(plan, query, search_results, organic_results, search_text, failed_sites=failed_sites, visited_sites=visited_sites)
+                results_dict, response = self.take_scrape(best_page, speculative, failed_sites)
 
-        attempts = 0
+                attempts += 1
 
-        while not response and attempts < 5:
-            print(f"Failed to retrieve content from {best_page}...Trying a different page")
-            print(f"Failed Sites: {failed_sites}")
-            best_page = self.get_search_page(plan, query, search_results, failed_sites=failed_sites)
-            results_dict, failed_sites, response = self.scrape_website_content(best_page)
+            if response:
+                results_dict = self.select_content(results_dict, search_text)
 
-            attempts += 1
+        finally:
+            # Speculative scrapes that were never picked are dropped if they have not started yet
+            for future in speculative.values():
+                future.cancel()
 
 
         if self.verbose:
@@ -0,0 +1,289 @@
+"""
+HTTP service mode: runs the agent as a long-lived process answering queries concurrently.
+
+    python server.py --port 8000 --workers 4 --queue-size 32 --deadline 300
+
+    POST /query                 {"query": "...", "deadline": 120}  -> 202 {"id": ..., "status": "queued"}
+                                add ?wait=1 to block until the answer is ready
+    GET  /query/<id>            status, and the result once finished
+    GET  /query/<id>/stream     server-sent events: an 'attempt' event as each integration pass starts, the
+                                pass's 'token' events as it is generated, then 'result'; text streamed before
+                                the last 'attempt' event was a draft rejected by QA
+    GET  /health                queue depth, busy workers and job counts
+
+When the queue is full new queries are rejected with 503 and a Retry-After header instead of piling up.
+"""
+import json
+import time
+import uuid
+import queue
+import asyncio
+import argparse
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from agent import build_agent
+
+
+class Job:
+    """
+    One submitted query, its status and its result. Tokens streamed by the integration agent are
+    collected as events, with an 'attempt' event at the start of each integration pass, so that
+    /stream clients can follow the answer as it is generated and drop drafts that QA rejected.
+    """
+    def __init__(self, query, deadline):
+        self.id = uuid.uuid4().hex
+        self.query = query
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.events = []
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.deadline = self.created_at + deadline
+        self.condition = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed", "expired")
+
+    def add_event(self, event, data):
+        with self.condition:
+            self.events.append((event, data))
+            self.condition.notify_all()
+
+    def add_token(self, token):
+        self.add_event("token", token)
+
+    def start_attempt(self, iteration):
+        self.add_event("attempt", {"iteration": iteration})
+
+    def finish(self, status, result=None, error=None):
+        with self.condition:
+            self.status = status
+            self.result = result
+            self.error = error
+            self.finished_at = time.time()
+            self.condition.notify_all()
+
+    def wait(self, timeout=None):
+        with self.condition:
+            return self.condition.wait_for(lambda: self.finished, timeout=timeout)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "query": self.query,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "queued_s": round((self.started_at or self.finished_at or time.time()) - self.created_at, 3),
+            "run_s": round((self.finished_at or time.time()) - self.started_at, 3) if self.started_at else None,
+        }
+
+
+class QueryService:
+    """
+    Bounded work queue in front of a pool of worker threads sharing one Agent (and so its connection
+    pools, caches and thread pool). Each worker runs one query at a time under its deadline; queries
+    still queued when their deadline passes are dropped without running. Finished jobs are kept for
+    result_ttl seconds so clients can collect them.
+    """
+    def __init__(self, agent, workers=4, queue_size=32, deadline=300, result_ttl=60 * 60):
+        self.agent = agent
+        self.workers = workers
+        self.deadline = deadline
+        self.result_ttl = result_ttl
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.busy = 0
+        self.rejected = 0
+        self.threads = [threading.Thread(target=self.work, daemon=True) for _ in range(workers)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def submit(self, query, deadline=None):
+        # Returns the queued job, or None when the queue is full and the query is shed
+        job = Job(query, min(deadline or self.deadline, self.deadline))
+        self.purge()
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            with self.lock:
+                self.rejected += 1
+            return None
+        with self.lock:
+            self.jobs[job.id] = job
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def purge(self):
+        cutoff = time.time() - self.result_ttl
+        with self.lock:
+            for job_id in [job_id for job_id, job in self.jobs.items() if job.finished and job.finished_at < cutoff]:
+                del self.jobs[job_id]
+
+    def work(self):
+        while True:
+            job = self.queue.get()
+            try:
+                self.run(job)
+            finally:
+                self.queue.task_done()
+
+    def run(self, job):
+        remaining = job.deadline - time.time()
+        if remaining <= 0:
+            job.finish("expired", error="Deadline passed while queued")
+            return
+
+        job.status = "running"
+        job.started_at = time.time()
+        with self.lock:
+            self.busy += 1
+        try:
+            result = asyncio.run(asyncio.wait_for(self.agent.run(job.query, on_token=job.add_token, on_attempt=job.start_attempt), timeout=remaining))
+            job.finish("done", result=result)
+        except asyncio.TimeoutError:
+            # The stage in flight finishes in the background; its result is discarded
+            job.finish("expired", error=f"Deadline of {round(job.deadline - job.created_at)}s exceeded")
+        except Exception as e:
+            job.finish("failed", error=str(e))
+        finally:
+            with self.lock:
+                self.busy -= 1
+
+    def stats(self):
+        with self.lock:
+            statuses = {}
+            for job in self.jobs.values():
+                statuses[job.status] = statuses.get(job.status, 0) + 1
+            return {
+                "queued": self.queue.qsize(),
+                "queue_size": self.queue.maxsize,
+                "workers": self.workers,
+                "busy_workers": self.busy,
+                "rejected": self.rejected,
+                "jobs": statuses,
+            }
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_event(self, event, data):
+        self.wfile.write(f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n".encode('utf-8'))
+        self.wfile.flush()
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != '/query':
+            return self.send_json(404, {"error": "Not found"})
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length) or b'{}')
+            query = body['query']
+            deadline = float(body['deadline']) if body.get('deadline') else None
+        except (ValueError, KeyError, TypeError) as e:
+            return self.send_json(400, {"error": f"Expected a JSON body with a 'query': {e}"})
+
+        service = self.server.service
+        job = service.submit(query, deadline=deadline)
+        if job is None:
+            return self.send_json(503, {"error": "Too many queued queries, try again later"}, headers={"Retry-After": "5"})
+
+        if parse_qs(url.query).get('wait', ['0'])[0] not in ('0', 'false', ''):
+            job.wait(timeout=max(job.deadline - time.time(), 0) + 5)
+            return self.send_json(200, job.to_dict())
+
+        self.send_json(202, job.to_dict(), headers={"Location": f"/query/{job.id}"})
+
+    def do_GET(self):
+        parts = urlsplit(self.path).path.strip('/').split('/')
+        service = self.server.service
+
+        if parts == ['health']:
+            return self.send_json(200, service.stats())
+
+        if len(parts) in (2, 3) and parts[0] == 'query':
+            job = service.get(parts[1])
+            if job is None:
+                return self.send_json(404, {"error": "Unknown query id"})
+            if len(parts) == 2:
+                return self.send_json(200, job.to_dict())
+            if parts[2] == 'stream':
+                return self.stream(job)
+
+        self.send_json(404, {"error": "Not found"})
+
+    def stream(self, job):
+        # Sends the events so far, then new ones as they arrive, and finally the result
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+
+        sent = 0
+        try:
+            while True:
+                with job.condition:
+                    job.condition.wait_for(lambda: len(job.events) > sent or job.finished, timeout=15)
+                    events = job.events[sent:]
+                    finished = job.finished
+                for event, data in events:
+                    self.send_event(event, data)
+                sent += len(events)
+                if finished:
+                    self.send_event("result", job.to_dict())
+                    return
+                if not events:
+                    # Keeps proxies from closing an idle connection while the agent searches
+                    self.wfile.write(b": keep-alive\n\n")
+                    self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away; the job keeps running and can still be polled
+            pass
+
+
+def serve(service, host="127.0.0.1", port=8000):
+    server = ThreadingHTTPServer((host, port), ServiceHandler)
+    server.daemon_threads = True
+    server.service = service
+    print(f"Serving the agent on http://{host}:{port} with {service.workers} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=4, help="queries run at the same time")
+    parser.add_argument('--queue-size', type=int, default=32, help="queries waiting before new ones are rejected")
+    parser.add_argument('--deadline', type=float, default=300, help="maximum seconds per query, including time queued")
+    args = parser.parse_args()
+
+    service = QueryService(build_agent(), workers=args.workers, queue_size=args.queue_size, deadline=args.deadline).start()
+    serve(service, host=args.host, port=args.port)
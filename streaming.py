@@ -0,0 +1,45 @@
+import json
+import tracing
+
+
+def iter_sse_tokens(response):
+    # OpenAI-compatible servers (OpenAI, vLLM on RunPod) stream server-sent events: 'data: {...}' lines ending with 'data: [DONE]'
+    for line in response.iter_lines():
+        line = line.decode('utf-8', errors='replace').strip()
+        if not line.startswith('data:'):
+            continue
+        data = line[len('data:'):].strip()
+        if data == '[DONE]':
+            return
+        chunk = json.loads(data)
+        if chunk.get('usage'):
+            # Sent as a final chunk when the request sets stream_options.include_usage
+            tracing.record_usage(chunk)
+        choices = chunk.get('choices') or []
+        if choices:
+            token = (choices[0].get('delta') or {}).get('content')
+            if token:
+                yield token
+
+
+def iter_ndjson_tokens(response):
+    # Ollama streams one JSON object per line, the last one with 'done': true
+    for line in response.iter_lines():
+        if not line.strip():
+            continue
+        chunk = json.loads(line)
+        token = chunk.get('response') or (chunk.get('message') or {}).get('content')
+        if token:
+            yield token
+        if chunk.get('done'):
+            tracing.record_usage(chunk)
+            return
+
+
+def iter_tokens(response, server):
+    """
+    Yields the generated text of a streamed completion response token by token.
+    """
+    if server == 'ollama':
+        return iter_ndjson_tokens(response)
+    return iter_sse_tokens(response)
@@ -0,0 +1,92 @@
+import re
+import unicodedata
+
+
+# C0/C1 control characters (other than whitespace) and private use code points never appear in real text
+CONTROL_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x9f\ue000-\uf8ff]')
+# Letters, digits and whitespace in any script (combining marks are not \w, see combining_marks)
+WORD_OR_SPACE_RE = re.compile(r'[\w\s]+')
+# Latin-1 Supplement and Latin Extended-A/B, which dominate when binary or misdecoded data is read as cp1252
+LATIN_EXTENDED_RE = re.compile('[\u0080-\u024f]')
+# UTF-8 decoded as cp1252/latin-1, e.g. 'Ã©' for 'é' or 'â€™' for a right quote
+MOJIBAKE_RE = re.compile('[\u00c2\u00c3][\u0080-\u00bf]|\u00e2\u20ac')
+
+ASCII_PUNCTUATION = str.maketrans('', '', '!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~')
+
+# Per-script limits on the share of characters that look like noise
+THRESHOLDS = {
+    'latin': {'noise': 0.05, 'symbols': 0.1, 'latin_extended': 0.3, 'mojibake': 0.01},
+    'other': {'noise': 0.05, 'symbols': 0.2, 'latin_extended': 0.3, 'mojibake': 0.01},
+}
+
+
+def combining_marks(text):
+    # Vowel signs, viramas and other combining marks (Mn/Mc/Me) are part of the letters in Devanagari, Bengali,
+    # Tamil, Thai... but are not matched by \w. Only the distinct characters are looked up, so this stays cheap.
+    return sum(text.count(char) for char in set(text) if unicodedata.category(char) in ('Mn', 'Mc', 'Me'))
+
+
+def text_stats(text, sample_chars=20000):
+    """
+    Character class counts for a bounded sample of the text, computed with C-level regex and
+    str methods rather than a Python loop over every character.
+    """
+    sample = text[:sample_chars]
+    length = len(sample)
+    ascii_chars = len(sample.encode('ascii', errors='ignore'))
+    # Whatever is left after removing letters, digits, combining marks, whitespace and ASCII punctuation is symbols or junk
+    leftover = WORD_OR_SPACE_RE.sub('', sample).translate(ASCII_PUNCTUATION)
+    symbols = len(leftover) - combining_marks(leftover)
+
+    return {
+        "length": length,
+        "script": 'latin' if length and ascii_chars / length > 0.5 else 'other',
+        "noise": sample.count('\ufffd') + len(CONTROL_RE.findall(sample)),
+        "symbols": symbols,
+        "latin_extended": len(LATIN_EXTENDED_RE.findall(sample)),
+        "mojibake": len(MOJIBAKE_RE.findall(sample)),
+    }
+
+
+def is_garbled(text, sample_chars=20000, thresholds=None):
+    """
+    Returns True if the text looks like binary data or a decoding failure.
+    Non-English pages are not penalised for being non-ASCII: letters in any script, with their combining marks, count as text,
+    and the limits depend on whether the sample is mostly Latin script or not.
+    """
+    stats = text_stats(text, sample_chars=sample_chars)
+    if not stats["length"]:
+        # If the text is empty, it cannot be garbled
+        return False
+
+    limits = (thresholds or THRESHOLDS)[stats["script"]]
+    return any(stats[key] / stats["length"] > limit for key, limit in limits.items())
+
+
+if __name__ == '__main__':
+    # Benchmark against the previous character-by-character check on large pages
+    import string
+    import timeit
+
+    def is_garbled_legacy(text):
+        non_ascii_chars = sum(1 for char in text if char not in string.printable)
+        try:
+            return non_ascii_chars / len(text) > 0.2
+        except ZeroDivisionError:
+            return False
+
+    pages = {
+        "english": "The sky appears blue because of Rayleigh scattering. " * 100000,
+        "russian": "Небо кажется голубым из-за рэлеевского рассеяния. " * 100000,
+        "hindi": "भारत एक विशाल देश है जिसकी संस्कृति बहुत पुरानी और समृद्ध है। " * 100000,
+        "bengali": "বাংলাদেশ দক্ষিণ এশিয়ার একটি দেশ এবং এর রাজধানী ঢাকা। " * 100000,
+        "tamil": "தமிழ் ஒரு பழமையான மொழி மற்றும் இது இந்தியாவில் பேசப்படுகிறது. " * 100000,
+        "thai": "ท้องฟ้าเป็นสีฟ้าเพราะการกระเจิงของแสงแบบเรย์ลี่ ซึ่งแสงสีน้ำเงินกระจายได้มากกว่าสีอื่น " * 100000,
+        "misdecoded": bytes(range(256)).decode('cp1252', errors='replace') * 20000,
+    }
+
+    for name, text in pages.items():
+        legacy = timeit.timeit(lambda: is_garbled_legacy(text), number=3) / 3
+        current = timeit.timeit(lambda: is_garbled(text), number=3) / 3
+        print(f"{name:>10} ({len(text) / 1e6:.1f}M chars): legacy {legacy * 1000:8.1f} ms -> {is_garbled_legacy(text)!s:5}  "
+              f"current {current * 1000:6.2f} ms -> {is_garbled(text)}")
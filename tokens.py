@@ -0,0 +1,25 @@
+try:
+    import tiktoken
+    encoder = tiktoken.get_encoding("cl100k_base")
+except Exception:  # tiktoken is optional (and needs to download its vocabulary once)
+    encoder = None
+
+
+def count_tokens(text):
+    """
+    Number of tokens in the text, exact with tiktoken installed and otherwise estimated at ~4 characters per token.
+    """
+    if not text:
+        return 0
+    if encoder is not None:
+        return len(encoder.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def truncate_tokens(text, max_tokens):
+    # Keeps the start of the text within max_tokens
+    if count_tokens(text) <= max_tokens:
+        return text
+    if encoder is not None:
+        return encoder.decode(encoder.encode(text, disallowed_special=())[:max_tokens])
+    return text[:max_tokens * 4]
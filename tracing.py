@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import threading
+import functools
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+
+current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    """
+    One timed stage of the agent loop.
+    Serialized with OpenTelemetry's field names (trace/span ids as hex, times in unix nanoseconds),
+    so exported spans can be loaded by OTLP tooling or read directly as JSONL.
+    """
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_span_id = parent.span_id if parent else None
+        self.attributes = dict(attributes or {})
+        self.status = {"code": "OK"}
+        self.start_time = time.time_ns()
+        self.end_time = None
+        self.lock = threading.Lock()
+
+    def set_attributes(self, **attributes):
+        with self.lock:
+            self.attributes.update(attributes)
+
+    def add(self, key, amount):
+        # Accumulates a numeric attribute, e.g. bytes read across chunks
+        with self.lock:
+            self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def end(self):
+        self.end_time = time.time_ns()
+
+    @property
+    def duration_ms(self):
+        end_time = self.end_time if self.end_time is not None else time.time_ns()
+        return (end_time - self.start_time) / 1e6
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "name": self.name,
+            "start_time_unix_nano": self.start_time,
+            "end_time_unix_nano": self.end_time,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "status": self.status,
+        }
+
+
+class Tracer:
+    """
+    Records spans for the stages of the agent loop.
+    Finished spans are kept in memory (the most recent max_spans) and, if a path is set, appended to a
+    JSONL file. Spans nest through a context variable, which follows asyncio tasks and is copied into
+    worker threads by Agent.run and by submit below.
+    """
+    def __init__(self, path=None, max_spans=10000):
+        self.path = path
+        self.spans = deque(maxlen=max_spans)
+        self.lock = threading.Lock()
+
+        if path and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        span = Span(name, parent=current_span.get(), attributes=attributes)
+        token = current_span.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.status = {"code": "ERROR", "message": str(e)}
+            raise
+        finally:
+            span.end()
+            current_span.reset(token)
+            self.export(span)
+
+    def export(self, span):
+        record = span.to_dict()
+        with self.lock:
+            self.spans.append(record)
+            if self.path:
+                with open(self.path, "a") as trace_file:
+                    trace_file.write(json.dumps(record, default=str) + "\n")
+
+    def summary(self):
+        """
+        Count, mean, p50 and p95 wall time in milliseconds per span name.
+        """
+        with self.lock:
+            durations = {}
+            for record in self.spans:
+                durations.setdefault(record["name"], []).append(record["duration_ms"])
+
+        summary = {}
+        for name, values in durations.items():
+            values.sort()
+            summary[name] = {
+                "count": len(values),
+                "mean_ms": round(sum(values) / len(values), 3),
+                "p50_ms": values[int(0.5 * (len(values) - 1))],
+                "p95_ms": values[int(0.95 * (len(values) - 1))],
+            }
+        return summary
+
+
+tracer = Tracer()
+
+
+def configure(path=None, max_spans=10000):
+    # Replaces the process-wide tracer, e.g. to export spans to a JSONL file
+    global tracer
+    tracer = Tracer(path=path, max_spans=max_spans)
+    return tracer
+
+
+def span(name, **attributes):
+    return tracer.span(name, **attributes)
+
+
+def set_attributes(**attributes):
+    # Annotates the current span, if any
+    current = current_span.get()
+    if current is not None:
+        current.set_attributes(**attributes)
+
+
+def add(key, amount):
+    current = current_span.get()
+    if current is not None:
+        current.add(key, amount)
+
+
+def get_attribute(key, default=None):
+    current = current_span.get()
+    if current is None:
+        return default
+    return current.attributes.get(key, default)
+
+
+def current_name(default=None):
+    # Name of the current span, e.g. the stage an LLM call is made from
+    current = current_span.get()
+    return current.name if current is not None else default
+
+
+def traced(name):
+    # Decorator that runs each call of the function inside a span
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def submit(executor, func, *args, **kwargs):
+    # executor.submit that runs func inside the caller's context, so its spans nest under the current one
+    context = contextvars.copy_context()
+    return executor.submit(context.run, func, *args, **kwargs)
+
+
+def record_usage(response_dict):
+    # Token counts as reported by OpenAI/vLLM ('usage') or Ollama ('prompt_eval_count'/'eval_count'),
+    # and the prompt tokens served from the server's prefix cache where it reports them
+    usage = response_dict.get('usage') or {}
+    prompt_tokens = usage.get('prompt_tokens', response_dict.get('prompt_eval_count'))
+    completion_tokens = usage.get('completion_tokens', response_dict.get('eval_count'))
+    cached_tokens = (usage.get('prompt_tokens_details') or {}).get('cached_tokens')
+    if prompt_tokens is not None:
+        set_attributes(prompt_tokens=prompt_tokens)
+    if completion_tokens is not None:
+        set_attributes(completion_tokens=completion_tokens)
+    if cached_tokens is not None:
+        set_attributes(cached_tokens=cached_tokens)